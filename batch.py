@@ -0,0 +1,143 @@
+"""
+Пакетная транскрипция: ограниченное число одновременно обрабатываемых файлов и ссылок,
+квоты AssemblyAI и OpenAI соблюдаются ограничителями из scheduler.
+
+Запуск из командной строки:
+    python batch.py calls/*.mp3 https://example.com/call.mp3 --concurrency 8 --output results.jsonl
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+from clients import get_clients, open_clients
+from cache import role_cache
+from repository import (
+    request_transcript,
+    wait_for_transcript,
+    upload_audio,
+    file_chunks,
+    hash_file,
+    cached_roles,
+    process_transcript,
+    single_flight,
+)
+
+logger = logging.getLogger(__name__)
+
+# Число одновременно обрабатываемых элементов пакета
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+
+async def transcribe_item(item):
+    """
+    Транскрибирует один элемент пакета: {"url": ...} или {"path": ..., "sha256": ...}.
+    Ссылку AssemblyAI скачивает сам, файл загружается потоково и проверяется по кэшу транскрипций.
+    Одинаковые файлы, обрабатываемые одновременно, транскрибируются один раз.
+    """
+    if "url" in item:
+        session = get_clients().assemblyai
+        transcript_id = await request_transcript(session, item["url"])
+        status_data = await wait_for_transcript(session, transcript_id)
+        return await process_transcript(status_data)
+
+    digest = item.get("sha256") or await asyncio.to_thread(hash_file, item["path"])
+    return await single_flight(digest, lambda: transcribe_file(item["path"], digest))
+
+async def transcribe_file(path, digest):
+    """
+    Возвращает роли из кэша или транскрибирует файл на диске и классифицирует роли.
+    """
+    roles = await cached_roles(digest)
+    if roles is not None:
+        return roles
+
+    session = get_clients().assemblyai
+    audio_url = await upload_audio(session, lambda: file_chunks(path))
+    transcript_id = await request_transcript(session, audio_url)
+    status_data = await wait_for_transcript(session, transcript_id)
+    return await process_transcript(status_data, digest)
+
+async def run_batch(items, on_progress=None, concurrency=BATCH_CONCURRENCY):
+    """
+    Обрабатывает элементы пакета, не более concurrency одновременно.
+    После каждого изменения статуса элемента вызывает on_progress(states, index).
+    Возвращает список состояний элементов.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    states = [
+        {"name": item["name"], "status": "queued", "result": None, "error": None}
+        for item in items
+    ]
+
+    async def notify(index):
+        if on_progress is not None:
+            await on_progress(states, index)
+
+    async def run(index, item):
+        async with semaphore:
+            state = states[index]
+            state["status"] = "running"
+            await notify(index)
+
+            started = time.monotonic()
+            try:
+                state["result"] = await transcribe_item(item)
+                state["status"] = "completed"
+            except Exception as e:
+                logger.exception(f"Ошибка обработки {item['name']}.")
+                state["status"] = "failed"
+                state["error"] = str(getattr(e, "detail", e))
+            finally:
+                if item.get("temporary"):
+                    os.remove(item["path"])
+            state["seconds"] = round(time.monotonic() - started, 2)
+            await notify(index)
+
+    await asyncio.gather(*(run(index, item) for index, item in enumerate(items)))
+    return states
+
+def progress(states):
+    """
+    Возвращает число завершенных элементов и их общее число.
+    """
+    done = sum(state["status"] in ("completed", "failed") for state in states)
+    return {"done": done, "total": len(states)}
+
+async def run_cli(args):
+    items = [
+        {"name": source, "url": source} if source.startswith(("http://", "https://"))
+        else {"name": source, "path": source}
+        for source in args.sources
+    ]
+
+    async def report(states, index):
+        state = states[index]
+        counts = progress(states)
+        print(f"[{counts['done']}/{counts['total']}] {state['name']}: {state['status']}", file=sys.stderr)
+
+    role_cache.load()
+    async with open_clients():
+        states = await run_batch(items, report, args.concurrency)
+    role_cache.save()
+
+    output = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    with output:
+        for state in states:
+            output.write(json.dumps(state, ensure_ascii=False) + "\n")
+
+    return 0 if all(state["status"] == "completed" for state in states) else 1
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетная транскрипция звонков")
+    parser.add_argument("sources", nargs="+", help="аудиофайлы или ссылки на них")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="сколько файлов обрабатывать одновременно")
+    parser.add_argument("--output", help="JSONL-файл для результатов (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(asyncio.run(run_cli(args)))
+
+if __name__ == "__main__":
+    main()
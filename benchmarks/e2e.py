@@ -0,0 +1,128 @@
+"""
+Офлайн-бенчмарк /transcribe: поднимает заглушки AssemblyAI и OpenAI, отправляет в main.app
+конкурентную нагрузку и выводит p50/p99 задержки, пропускную способность,
+число запросов к OpenAI на диалог и разбивку по этапам из /metrics.
+
+Запуск из корня репозитория:
+    python benchmarks/e2e.py --dialogues 50 --concurrency 10 --openai-latency 0.3
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_servers import FakeAssemblyAI, FakeOpenAI, start_server
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк /transcribe")
+    parser.add_argument("--dialogues", type=int, default=20, help="сколько звонков отправить")
+    parser.add_argument("--concurrency", type=int, default=5, help="сколько звонков обрабатывать одновременно")
+    parser.add_argument("--utterances", type=int, default=60, help="реплик в синтетическом звонке")
+    parser.add_argument("--audio-size", type=int, default=256 * 1024, help="размер аудиофайла в байтах")
+    parser.add_argument("--assemblyai-latency", type=float, default=0.05)
+    parser.add_argument("--queue-time", type=float, default=0.5)
+    parser.add_argument("--processing-time", type=float, default=2.0)
+    parser.add_argument("--openai-latency", type=float, default=0.3)
+    parser.add_argument("--mode", default="batch", choices=("batch", "utterance", "speaker"))
+    return parser.parse_args()
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def configure(args, assemblyai_url, openai_url):
+    """
+    Направляет приложение на заглушки. Переменные задаются до импорта main.
+    Квоты по умолчанию сняты, чтобы измерять само приложение; их можно задать через окружение.
+    """
+    os.environ.update({
+        "ASSEMBLYAI_URL": f"{assemblyai_url}/v2",
+        "OPENAI_URL": f"{openai_url}/v1",
+        "ASSEMBLYAI_API_KEY": "bench",
+        "OPENAI_API_KEY": "bench",
+        "CLASSIFICATION_MODE": args.mode,
+        "TRANSCRIPTION_CACHE_DIR": "",
+        "ROLE_CACHE_PATH": "",
+        "POLL_INITIAL_DELAY": os.getenv("POLL_INITIAL_DELAY", "0.25"),
+    })
+    os.environ.pop("PROXY_URL", None)
+    for name in (
+        "ASSEMBLYAI_UPLOADS_PER_MINUTE",
+        "ASSEMBLYAI_JOBS_PER_MINUTE",
+        "OPENAI_REQUESTS_PER_MINUTE",
+        "OPENAI_TOKENS_PER_MINUTE",
+    ):
+        os.environ.setdefault(name, "1000000000")
+
+async def run(args):
+    assemblyai = FakeAssemblyAI(args.assemblyai_latency, args.queue_time, args.processing_time, args.utterances)
+    openai = FakeOpenAI(args.openai_latency)
+    assemblyai_runner, assemblyai_url = await start_server(assemblyai.app())
+    openai_runner, openai_url = await start_server(openai.app())
+
+    configure(args, assemblyai_url, openai_url)
+    os.chdir(ROOT)
+    import httpx
+    import logging
+    import main
+    import metrics
+    logging.getLogger().setLevel(logging.WARNING)
+
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+
+            async def call(index):
+                nonlocal errors
+                # Уникальное содержимое, чтобы не попадать в кэш транскрипций
+                audio = os.urandom(args.audio_size)
+                async with semaphore:
+                    started = time.perf_counter()
+                    response = await client.post("/transcribe", files={"file": (f"call-{index}.mp3", audio)})
+                    latencies.append(time.perf_counter() - started)
+                if "transcription" not in response.json():
+                    errors += 1
+
+            started = time.perf_counter()
+            await asyncio.gather(*(call(index) for index in range(args.dialogues)))
+            elapsed = time.perf_counter() - started
+
+            exposition = (await client.get("/metrics")).text
+
+    await assemblyai_runner.cleanup()
+    await openai_runner.cleanup()
+
+    report(args, latencies, errors, elapsed, assemblyai, openai, metrics, exposition)
+
+def report(args, latencies, errors, elapsed, assemblyai, openai, metrics, exposition):
+    print(f"Звонков: {args.dialogues}, одновременно: {args.concurrency}, режим: {args.mode}, ошибок: {errors}")
+    print(f"Задержка: p50 {percentile(latencies, 0.5):.3f} с, p99 {percentile(latencies, 0.99):.3f} с")
+    print(f"Пропускная способность: {args.dialogues / elapsed:.2f} звонков/с")
+    print(f"Запросов к OpenAI на звонок: {openai.requests / args.dialogues:.2f}, символов промпта на звонок: {openai.prompt_chars / args.dialogues:.0f}")
+    print(f"Запросов к AssemblyAI: {assemblyai.requests}")
+
+    print("Этапы (число, среднее):")
+    for (stage,), series in sorted(metrics.STAGE_SECONDS.values.items()):
+        print(f"  {stage:<22} {series['count']:>7} {series['sum'] / series['count'] * 1000:10.2f} мс")
+
+    lookups = sum(metrics.PHRASE_LOOKUPS.values.values())
+    hits = sum(metrics.PHRASE_HITS.values.values())
+    print(f"Доля реплик с ключевыми фразами: {hits / lookups if lookups else 0:.2%}")
+    decisions = {source: int(count) for (source,), count in sorted(metrics.ROLE_DECISIONS.values.items())}
+    print(f"Источники решений о ролях: {decisions}")
+    print(f"Размер /metrics: {len(exposition)} байт")
+
+def main():
+    asyncio.run(run(parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Локальные заглушки AssemblyAI и OpenAI для офлайн-бенчмарков.
+Задержки настраиваются, транскрипции генерируются из синтетических реплик.
+"""
+import re
+import json
+import time
+import uuid
+import random
+import asyncio
+from aiohttp import web
+
+MANAGER_LINES = [
+    "Здравствуйте, меня зовут Анна, компания Интерьер.",
+    "Вы интересовались ремонтом квартиры, подскажите, запрос актуален?",
+    "Какой стиль вам ближе?",
+    "Когда вам будет удобно встретиться с дизайнером?",
+    "Давайте я запишу ваши пожелания.",
+    "Хорошо, тогда до встречи.",
+]
+CLIENT_LINES = [
+    "Здравствуйте.",
+    "Да, конечно.",
+    "Ага.",
+    "Хорошо.",
+    "Мы хотим сделать ремонт в двухкомнатной квартире.",
+    "Наверное что-то светлое и простое.",
+    "Лучше на следующей неделе вечером.",
+]
+
+def synthetic_words(utterances, seed=0):
+    """
+    Генерирует слова транскрипции AssemblyAI: чередующиеся спикеры A (менеджер) и B (клиент).
+    """
+    rng = random.Random(seed)
+    words = []
+    position = 0
+    for i in range(utterances):
+        speaker, lines = ("A", MANAGER_LINES) if i % 2 == 0 else ("B", CLIENT_LINES)
+        for text in rng.choice(lines).split():
+            words.append({"text": text, "speaker": speaker, "start": position, "end": position + 300})
+            position += 350
+    return words
+
+class FakeAssemblyAI:
+    """
+    Заглушка API AssemblyAI: загрузка, создание задачи и статус задачи.
+    Задача находится в очереди queue_time секунд, затем обрабатывается processing_time секунд.
+    """
+
+    def __init__(self, latency=0.05, queue_time=0.5, processing_time=2.0, utterances=60):
+        self.latency = latency
+        self.queue_time = queue_time
+        self.processing_time = processing_time
+        self.utterances = utterances
+        self.transcripts = {}
+        self.requests = {"upload": 0, "transcript": 0, "status": 0}
+
+    def app(self):
+        app = web.Application(client_max_size=1024 ** 3)
+        app.router.add_post("/v2/upload", self.upload)
+        app.router.add_post("/v2/transcript", self.create)
+        app.router.add_get("/v2/transcript/{transcript_id}", self.status)
+        return app
+
+    async def upload(self, request):
+        self.requests["upload"] += 1
+        await request.read()
+        await asyncio.sleep(self.latency)
+        return web.json_response({"upload_url": f"https://fake.assemblyai/{uuid.uuid4().hex}"})
+
+    async def create(self, request):
+        self.requests["transcript"] += 1
+        await request.json()
+        await asyncio.sleep(self.latency)
+        transcript_id = uuid.uuid4().hex
+        self.transcripts[transcript_id] = time.monotonic()
+        return web.json_response({"id": transcript_id, "status": "queued"})
+
+    async def status(self, request):
+        self.requests["status"] += 1
+        await asyncio.sleep(self.latency)
+        transcript_id = request.match_info["transcript_id"]
+        elapsed = time.monotonic() - self.transcripts[transcript_id]
+        if elapsed < self.queue_time:
+            return web.json_response({"id": transcript_id, "status": "queued"})
+        if elapsed < self.queue_time + self.processing_time:
+            return web.json_response({"id": transcript_id, "status": "processing"})
+        seed = int(transcript_id[:8], 16)
+        return web.json_response({
+            "id": transcript_id,
+            "status": "completed",
+            "words": synthetic_words(self.utterances, seed),
+        })
+
+class FakeOpenAI:
+    """
+    Заглушка OpenAI Chat Completions. На пакетный запрос отвечает JSON-объектом ролей
+    для всех фраз с пометкой [?], на остальные — одним словом.
+    """
+
+    def __init__(self, latency=0.3):
+        self.latency = latency
+        self.requests = 0
+        self.prompt_chars = 0
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.complete)
+        return app
+
+    async def complete(self, request):
+        self.requests += 1
+        body = await request.json()
+        content = body["messages"][-1]["content"]
+        self.prompt_chars += sum(len(message["content"]) for message in body["messages"])
+        await asyncio.sleep(self.latency)
+
+        pending = re.findall(r"^(\d+)\. \[\?\]", content, flags=re.MULTILINE)
+        if pending:
+            answer = json.dumps(
+                {number: "Менеджер" if int(number) % 2 else "Клиент" for number in pending},
+                ensure_ascii=False
+            )
+        else:
+            answer = "Клиент"
+        return web.json_response({"choices": [{"message": {"role": "assistant", "content": answer}}]})
+
+async def start_server(app):
+    """
+    Запускает приложение aiohttp на свободном локальном порту. Возвращает runner и базовый URL.
+    """
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
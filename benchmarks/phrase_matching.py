@@ -0,0 +1,75 @@
+"""
+Микро-бенчмарк поиска ключевых фраз: прежний цикл any(phrase in text.lower())
+против индекса Ахо-Корасик из phrase_index.
+
+Запуск из корня репозитория:
+    python benchmarks/phrase_matching.py
+"""
+import os
+import sys
+import random
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from phrase_index import PhraseIndex, load_entries, KEY_PHRASES_PATH
+
+UTTERANCES = [
+    "Здравствуйте, меня зовут Анна, компания Интерьер, вам удобно сейчас говорить?",
+    "Да, конечно.",
+    "Алло",
+    "Вы интересовались ремонтом под ключ, подскажите, актуален ли еще запрос?",
+    "Ну в принципе да, мы хотели бы сделать дизайн квартиры в Москве.",
+    "Хорошо, давайте уточним, какой стиль вам ближе и когда планируете начать?",
+    "Пока не знаем, сколько это будет стоить?",
+    "Стоимость зависит от площади, могу назначить встречу с дизайнером.",
+]
+
+def legacy_role(text, manager_phrases, client_phrases):
+    if any(phrase in text.lower() for phrase in manager_phrases):
+        return "Менеджер"
+    if any(phrase in text.lower() for phrase in client_phrases):
+        return "Клиент"
+    return None
+
+def synthetic_entries(count, seed=0):
+    """
+    Генерирует count случайных фраз из слов тестовых реплик, чтобы смоделировать большие списки.
+    """
+    rng = random.Random(seed)
+    words = " ".join(UTTERANCES).lower().replace(",", "").replace("?", "").replace(".", "").split()
+    entries = []
+    for i in range(count):
+        phrase = " ".join(rng.sample(words, rng.randint(2, 3))) + f" {i}"
+        entries.append((phrase, "manager" if i % 2 else "client", 1.0))
+    return entries
+
+def run(entries, number):
+    manager_phrases = [phrase for phrase, side, _ in entries if side == "manager"]
+    client_phrases = [phrase for phrase, side, _ in entries if side == "client"]
+    index = PhraseIndex(entries)
+
+    legacy = timeit.timeit(
+        lambda: [legacy_role(text, manager_phrases, client_phrases) for text in UTTERANCES],
+        number=number,
+    )
+    indexed = timeit.timeit(
+        lambda: [index.side_weights(text) for text in UTTERANCES],
+        number=number,
+    )
+
+    per_call = number * len(UTTERANCES)
+    print(
+        f"{len(entries):>6} фраз: цикл {legacy / per_call * 1e6:8.2f} мкс/реплика, "
+        f"индекс {indexed / per_call * 1e6:8.2f} мкс/реплика, "
+        f"ускорение x{legacy / indexed:.1f}"
+    )
+
+def main():
+    entries = load_entries(KEY_PHRASES_PATH)
+    run(entries, number=2000)
+    for count in (500, 2000, 10000):
+        run(entries + synthetic_entries(count), number=200)
+
+if __name__ == "__main__":
+    main()
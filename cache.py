@@ -0,0 +1,324 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import tempfile
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Кэш результатов транскрипции по SHA-256 аудиофайла.
+# Пустой TRANSCRIPTION_CACHE_DIR отключает хранение на диске.
+TRANSCRIPTION_CACHE_DIR = os.getenv("TRANSCRIPTION_CACHE_DIR", ".cache/transcriptions")
+TRANSCRIPTION_CACHE_MAX_ITEMS = int(os.getenv("TRANSCRIPTION_CACHE_MAX_ITEMS", "256"))
+TRANSCRIPTION_CACHE_MAX_BYTES = int(os.getenv("TRANSCRIPTION_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+# Лимит памяти считается по размеру записи в JSON
+TRANSCRIPTION_CACHE_MEMORY_BYTES = int(os.getenv("TRANSCRIPTION_CACHE_MEMORY_BYTES", str(64 * 1024 * 1024)))
+TRANSCRIPTION_CACHE_TTL = float(os.getenv("TRANSCRIPTION_CACHE_TTL", str(30 * 24 * 3600)))
+
+class LRUCache:
+    """
+    Кэш в памяти с вытеснением давно неиспользуемых записей и временем жизни записи.
+    Размер ограничивается числом записей и, если задан max_bytes, суммарным размером записей.
+    """
+
+    def __init__(self, max_items, ttl=None, max_bytes=None):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.items = OrderedDict()
+        self.sizes = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, key):
+        item = self.items.get(key)
+        if item is None or self.expired(item[0]):
+            if item is not None:
+                self.discard(key)
+            self.misses += 1
+            return None
+        self.items.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def set(self, key, value, created_at=None, size=0):
+        self.discard(key)
+        if self.max_bytes is not None and size > self.max_bytes:
+            # Запись больше всего лимита не вытесняет остальные и в памяти не хранится
+            return
+        self.items[key] = (created_at or time.time(), value)
+        self.sizes[key] = size
+        self.bytes += size
+        while len(self.items) > self.max_items or (self.max_bytes is not None and self.bytes > self.max_bytes):
+            self.discard(next(iter(self.items)))
+
+    def discard(self, key):
+        if self.items.pop(key, None) is not None:
+            self.bytes -= self.sizes.pop(key)
+
+    def expired(self, created_at):
+        return self.ttl is not None and time.time() - created_at > self.ttl
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "items": len(self.items),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+class TranscriptionCache:
+    """
+    Двухуровневый кэш результатов транскрипции: LRU в памяти и каталог JSON-файлов на диске.
+    Оба уровня ограничены суммарным размером записей. Ключ — SHA-256 аудиофайла.
+    """
+
+    def __init__(self, directory, max_items, max_bytes, ttl, memory_bytes=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.memory = LRUCache(max_items, ttl, memory_bytes)
+        self.disk_hits = 0
+
+    def path(self, digest):
+        return os.path.join(self.directory, f"{digest}.json")
+
+    async def get(self, digest):
+        """
+        Возвращает запись кэша или None. Запись с диска поднимается в память.
+        """
+        value = self.memory.get(digest)
+        if value is not None or not self.directory:
+            return value
+
+        entry, size = await asyncio.to_thread(self._read, digest)
+        if entry is None:
+            return None
+        self.disk_hits += 1
+        self.memory.set(digest, entry["value"], entry["created_at"], size)
+        return entry["value"]
+
+    async def set(self, digest, value):
+        """
+        Сохраняет запись в память и на диск. Ошибка записи на диск только логируется:
+        результат уже получен, и кэш не должен превращать его в ошибку.
+        """
+        created_at = time.time()
+        try:
+            data = await asyncio.to_thread(json.dumps, {"created_at": created_at, "value": value}, ensure_ascii=False)
+            self.memory.set(digest, value, created_at, len(data.encode("utf-8")))
+            if self.directory:
+                await asyncio.to_thread(self._write, digest, data)
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить запись кэша {digest}: {e}")
+
+    def _read(self, digest):
+        """
+        Читает запись с диска. Возвращает запись и ее размер в байтах или (None, 0).
+        """
+        path = self.path(digest)
+        try:
+            with open(path, "rb") as file:
+                data = file.read()
+            entry = json.loads(data)
+            expired = time.time() - entry["created_at"] > self.ttl
+            entry = {"created_at": entry["created_at"], "value": entry["value"]}
+        except FileNotFoundError:
+            return None, 0
+        except OSError as e:
+            logger.warning(f"Не удалось прочитать запись кэша {path}: {e}")
+            return None, 0
+        except (ValueError, KeyError, TypeError) as e:
+            # Запись не в формате кэша: удаляем, чтобы она не мешала следующим запросам
+            logger.warning(f"Поврежденная запись кэша {path}: {e!r}")
+            self._remove(path)
+            return None, 0
+
+        if expired:
+            self._remove(path)
+            return None, 0
+
+        # Время изменения файла служит отметкой последнего использования для вытеснения
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return entry, len(data)
+
+    def _write(self, digest, data):
+        # Каталог создается при первой записи, чтобы импорт не зависел от прав на запись.
+        # У каждой записи свой временный файл: одновременные записи одного хеша не мешают друг другу.
+        os.makedirs(self.directory, exist_ok=True)
+        temporary = tempfile.NamedTemporaryFile(
+            "w", encoding="utf-8", dir=self.directory, suffix=".tmp", delete=False
+        )
+        try:
+            with temporary:
+                temporary.write(data)
+            os.replace(temporary.name, self.path(digest))
+        except BaseException:
+            self._remove(temporary.name)
+            raise
+        self._evict()
+
+    def _evict(self):
+        """
+        Удаляет с диска просроченные записи и самые старые записи сверх лимита размера.
+        """
+        files = []
+        total = 0
+        now = time.time()
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".json"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                # Файл удалила параллельная запись
+                continue
+            if now - stat.st_mtime > self.ttl:
+                self._remove(entry.path)
+                continue
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+
+        files.sort()
+        for _, size, path in files:
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def stats(self):
+        # Каждый поиск начинается с памяти; промах памяти, найденный на диске, считается попаданием
+        lookups = self.memory.hits + self.memory.misses
+        hits = self.memory.hits + self.disk_hits
+        return {
+            "items": len(self.memory),
+            "bytes": self.memory.bytes,
+            "hits": hits,
+            "memory_hits": self.memory.hits,
+            "disk_hits": self.disk_hits,
+            "misses": lookups - hits,
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
+
+transcription_cache = TranscriptionCache(
+    TRANSCRIPTION_CACHE_DIR,
+    TRANSCRIPTION_CACHE_MAX_ITEMS,
+    TRANSCRIPTION_CACHE_MAX_BYTES,
+    TRANSCRIPTION_CACHE_TTL,
+    TRANSCRIPTION_CACHE_MEMORY_BYTES,
+)
+
+# Кэш предсказаний ролей OpenAI. Пустой ROLE_CACHE_PATH отключает сохранение на диск.
+ROLE_CACHE_MAX_ITEMS = int(os.getenv("ROLE_CACHE_MAX_ITEMS", "10000"))
+ROLE_CACHE_TTL = float(os.getenv("ROLE_CACHE_TTL", str(7 * 24 * 3600)))
+ROLE_CACHE_MIN_CONFIDENCE = float(os.getenv("ROLE_CACHE_MIN_CONFIDENCE", "0.75"))
+ROLE_CACHE_PATH = os.getenv("ROLE_CACHE_PATH", "")
+
+class RolePredictionCache:
+    """
+    Кэш ответов OpenAI о роли реплики. Для каждого ключа хранится число ответов по ролям;
+    роль переиспользуется, только если ее доля не ниже min_confidence.
+    """
+
+    def __init__(self, max_items, ttl, min_confidence, path=None):
+        self.entries = LRUCache(max_items, ttl)
+        self.min_confidence = min_confidence
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.low_confidence = 0
+        self.backchannel_hits = 0
+
+    def get(self, key):
+        """
+        Возвращает роль по ключу или None, если ответов нет или они противоречивы.
+        """
+        counts = self.entries.get(key)
+        if counts is None:
+            self.misses += 1
+            return None
+
+        role, votes = max(counts.items(), key=lambda item: item[1])
+        if votes / sum(counts.values()) < self.min_confidence:
+            self.low_confidence += 1
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return role
+
+    def remember(self, key, role):
+        """
+        Добавляет ответ модели для ключа.
+        """
+        counts = self.entries.items.get(key)
+        if counts is None or self.entries.expired(counts[0]):
+            self.entries.set(key, {role: 1})
+            return
+        counts[1][role] = counts[1].get(role, 0) + 1
+        self.entries.items.move_to_end(key)
+
+    def load(self):
+        """
+        Загружает сохраненные предсказания с диска, пропуская просроченные.
+        """
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                items = json.load(file)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Не удалось загрузить кэш предсказаний {self.path}: {e}")
+            return
+        for key, created_at, counts in items:
+            if not self.entries.expired(created_at):
+                self.entries.set(key, counts, created_at)
+        logger.info(f"Загружено предсказаний из кэша: {len(self.entries)}")
+
+    def save(self):
+        """
+        Сохраняет предсказания на диск.
+        """
+        if not self.path:
+            return
+        items = [[key, created_at, counts] for key, (created_at, counts) in self.entries.items.items()]
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w", encoding="utf-8") as file:
+            json.dump(items, file, ensure_ascii=False)
+        os.replace(temporary, self.path)
+
+    def stats(self):
+        # Поддакивания, определенные без кэша, входят в число промахов
+        total = self.hits + self.misses
+        return {
+            "items": len(self.entries),
+            "hits": self.hits,
+            "backchannel_hits": self.backchannel_hits,
+            "misses": self.misses,
+            "low_confidence": self.low_confidence,
+            "hit_rate": (self.hits + self.backchannel_hits) / total if total else 0.0,
+        }
+
+role_cache = RolePredictionCache(
+    ROLE_CACHE_MAX_ITEMS,
+    ROLE_CACHE_TTL,
+    ROLE_CACHE_MIN_CONFIDENCE,
+    ROLE_CACHE_PATH,
+)
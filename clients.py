@@ -0,0 +1,80 @@
+import os
+import logging
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
+import aiohttp
+import httpx
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+PROXY_URL = os.getenv("PROXY_URL")
+OPENAI_URL = os.getenv("OPENAI_URL", "https://api.openai.com/v1")
+
+# Ограничения пулов соединений и таймауты (в секундах)
+ASSEMBLYAI_CONNECTION_LIMIT = int(os.getenv("ASSEMBLYAI_CONNECTION_LIMIT", "20"))
+OPENAI_CONNECTION_LIMIT = int(os.getenv("OPENAI_CONNECTION_LIMIT", "20"))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "60"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+ASSEMBLYAI_TIMEOUT = float(os.getenv("ASSEMBLYAI_TIMEOUT", "600"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+
+class HttpClients:
+    """
+    HTTP-клиенты с пулами соединений, общие для всех запросов приложения.
+    """
+
+    def __init__(self):
+        self.assemblyai = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=ASSEMBLYAI_CONNECTION_LIMIT,
+                keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+            ),
+            timeout=aiohttp.ClientTimeout(
+                total=ASSEMBLYAI_TIMEOUT,
+                sock_connect=HTTP_CONNECT_TIMEOUT,
+            ),
+        )
+        self.openai = httpx.AsyncClient(
+            base_url=OPENAI_URL,
+            headers={"Authorization": f"Bearer {OPENAI_API_KEY}"},
+            proxy=PROXY_URL,
+            limits=httpx.Limits(
+                max_connections=OPENAI_CONNECTION_LIMIT,
+                max_keepalive_connections=OPENAI_CONNECTION_LIMIT,
+                keepalive_expiry=HTTP_KEEPALIVE_TIMEOUT,
+            ),
+            timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        )
+
+    async def close(self):
+        await self.assemblyai.close()
+        await self.openai.aclose()
+
+_clients = None
+
+@asynccontextmanager
+async def open_clients():
+    """
+    Создает общие HTTP-клиенты на время жизни приложения (lifespan FastAPI или CLI).
+    """
+    global _clients
+
+    _clients = HttpClients()
+    logger.info("HTTP-клиенты созданы.")
+    try:
+        yield _clients
+    finally:
+        await _clients.close()
+        _clients = None
+        logger.info("HTTP-клиенты закрыты.")
+
+def get_clients():
+    """
+    Возвращает общие HTTP-клиенты. Их нужно открыть через open_clients().
+    """
+    if _clients is None:
+        raise RuntimeError("HTTP-клиенты не созданы: используйте open_clients()")
+    return _clients
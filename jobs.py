@@ -0,0 +1,415 @@
+import os
+import time
+import uuid
+import json
+import hashlib
+import asyncio
+import logging
+import tempfile
+import importlib
+from abc import ABC, abstractmethod
+from fastapi import HTTPException
+import metrics
+from clients import get_clients
+from repository import (
+    PUBLIC_BASE_URL,
+    POLL_INITIAL_DELAY,
+    UPLOAD_CHUNK_SIZE,
+    upload_audio,
+    file_chunks,
+    request_transcript,
+    fetch_transcript,
+    transcript_finished,
+    next_poll_delay,
+    process_transcript,
+    cached_roles,
+    single_flight,
+)
+from batch import run_batch, progress
+
+logger = logging.getLogger(__name__)
+
+# Хранилище задач в формате "модуль:Класс"; по умолчанию — в памяти процесса
+JOB_STORE = os.getenv("JOB_STORE", "jobs:InMemoryJobStore")
+
+# Время хранения завершенных задач (в секундах)
+JOB_TTL = float(os.getenv("JOB_TTL", "3600"))
+
+# Интервал страховочного опроса AssemblyAI, когда о завершении сообщает вебхук
+WEBHOOK_POLL_DELAY = float(os.getenv("WEBHOOK_POLL_DELAY", "30"))
+
+# Статусы задачи
+QUEUED = "queued"
+TRANSCRIBING = "transcribing"
+CLASSIFYING = "classifying"
+COMPLETED = "completed"
+FAILED = "failed"
+FINISHED = (COMPLETED, FAILED)
+
+class JobStore(ABC):
+    """
+    Интерфейс хранилища задач транскрипции.
+    Задача — словарь, поле version увеличивается при каждом изменении.
+    """
+
+    @abstractmethod
+    async def create(self, job):
+        ...
+
+    @abstractmethod
+    async def get(self, job_id):
+        ...
+
+    @abstractmethod
+    async def update(self, job_id, **fields):
+        ...
+
+    @abstractmethod
+    async def claim(self, job_id, expected_status, new_status):
+        """
+        Атомарно переводит задачу из expected_status в new_status. Возвращает False, если статус другой.
+        """
+        ...
+
+    @abstractmethod
+    async def find_by_transcript(self, transcript_id):
+        ...
+
+    async def wait_for_change(self, job_id, version, timeout):
+        """
+        Ожидает изменения задачи относительно version не дольше timeout секунд и возвращает задачу.
+        Реализация по умолчанию опрашивает хранилище раз в секунду.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            job = await self.get(job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job["version"] != version or remaining <= 0:
+                return job
+            await asyncio.sleep(min(1.0, remaining))
+
+class InMemoryJobStore(JobStore):
+    """
+    Хранилище задач в памяти процесса. Подходит для одного воркера uvicorn.
+    """
+
+    def __init__(self):
+        self.jobs = {}
+        self.transcripts = {}
+        self.events = {}
+
+    async def create(self, job):
+        self.cleanup()
+        job = dict(job, version=0, created_at=time.time(), updated_at=time.time())
+        self.jobs[job["id"]] = job
+        self.events[job["id"]] = asyncio.Event()
+        return dict(job)
+
+    async def get(self, job_id):
+        job = self.jobs.get(job_id)
+        return dict(job) if job is not None else None
+
+    async def update(self, job_id, **fields):
+        job = self.jobs[job_id]
+        job.update(fields, version=job["version"] + 1, updated_at=time.time())
+        if job.get("transcript_id"):
+            self.transcripts[job["transcript_id"]] = job_id
+
+        # Будим ожидающих и заводим новое событие для следующего изменения
+        self.events[job_id].set()
+        self.events[job_id] = asyncio.Event()
+        return dict(job)
+
+    async def claim(self, job_id, expected_status, new_status):
+        job = self.jobs.get(job_id)
+        if job is None or job["status"] != expected_status:
+            return False
+        await self.update(job_id, status=new_status)
+        return True
+
+    async def find_by_transcript(self, transcript_id):
+        job_id = self.transcripts.get(transcript_id)
+        return await self.get(job_id) if job_id else None
+
+    async def wait_for_change(self, job_id, version, timeout):
+        job = self.jobs.get(job_id)
+        if job is None or job["version"] != version:
+            return await self.get(job_id)
+        try:
+            await asyncio.wait_for(self.events[job_id].wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return await self.get(job_id)
+
+    def cleanup(self):
+        """
+        Удаляет завершенные задачи старше JOB_TTL.
+        """
+        expired_before = time.time() - JOB_TTL
+        for job_id, job in list(self.jobs.items()):
+            if job["status"] in FINISHED and job["updated_at"] < expired_before:
+                del self.jobs[job_id]
+                del self.events[job_id]
+                self.transcripts.pop(job.get("transcript_id"), None)
+
+def create_job_store(path=JOB_STORE):
+    """
+    Создает хранилище задач по пути "модуль:Класс".
+    """
+    module_name, class_name = path.split(":")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+job_store = create_job_store()
+
+# Ссылки на фоновые задачи, чтобы их не собрал сборщик мусора
+_background_tasks = set()
+
+def spawn(coro):
+    """
+    Запускает корутину в фоне.
+    """
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+def webhook_url():
+    """
+    Возвращает адрес вебхука AssemblyAI или None, если публичный адрес сервиса не задан.
+    """
+    if not PUBLIC_BASE_URL:
+        return None
+    return f"{PUBLIC_BASE_URL.rstrip('/')}/webhooks/assemblyai"
+
+def copy_and_hash(source, target):
+    """
+    Копирует файл по фрагментам, одновременно считая SHA-256. Возвращает хеш.
+    """
+    hasher = hashlib.sha256()
+    while chunk := source.read(UPLOAD_CHUNK_SIZE):
+        hasher.update(chunk)
+        target.write(chunk)
+    return hasher.hexdigest()
+
+async def spool_upload(file_obj):
+    """
+    Копирует загруженный файл во временный файл, чтобы обработать его после ответа клиенту.
+    Возвращает путь к файлу и SHA-256 содержимого.
+    """
+    spooled = tempfile.NamedTemporaryFile(prefix="smart-", delete=False)
+    with spooled:
+        digest = await asyncio.to_thread(copy_and_hash, file_obj.file, spooled)
+    return spooled.name, digest
+
+async def start_transcription_job(file_obj):
+    """
+    Создает задачу транскрипции и запускает ее обработку в фоне. Возвращает задачу.
+    """
+    path, digest = await spool_upload(file_obj)
+    job = await job_store.create({
+        "id": uuid.uuid4().hex,
+        "status": QUEUED,
+        "filename": file_obj.filename,
+        "sha256": digest,
+        "transcript_id": None,
+        "result": None,
+        "error": None,
+    })
+    spawn(run_transcription_job(job["id"], path))
+    return job
+
+async def start_batch_job(files, urls):
+    """
+    Создает пакетную задачу из загруженных файлов и ссылок и запускает ее в фоне.
+    Прогресс каждого элемента доступен в поле items задачи.
+    """
+    items = []
+    for file_obj in files:
+        path, digest = await spool_upload(file_obj)
+        items.append({"name": file_obj.filename, "path": path, "sha256": digest, "temporary": True})
+    for url in urls:
+        items.append({"name": url, "url": url})
+
+    job = await job_store.create({
+        "id": uuid.uuid4().hex,
+        "status": QUEUED,
+        "kind": "batch",
+        "items": [{"name": item["name"], "status": "queued", "result": None, "error": None} for item in items],
+        "progress": {"done": 0, "total": len(items)},
+        "transcript_id": None,
+        "result": None,
+        "error": None,
+    })
+    spawn(run_batch_job(job["id"], items))
+    return job
+
+async def run_batch_job(job_id, items):
+    """
+    Обрабатывает пакет и сохраняет прогресс после каждого изменения статуса элемента.
+    """
+    async def report(states, index):
+        await job_store.update(
+            job_id,
+            status=TRANSCRIBING,
+            items=[dict(state) for state in states],
+            progress=progress(states)
+        )
+
+    try:
+        states = await run_batch(items, report)
+        await job_store.update(job_id, status=COMPLETED, items=states, progress=progress(states))
+    except Exception as e:
+        logger.exception(f"Ошибка в пакетной задаче {job_id}.")
+        await fail_job(job_id, e)
+
+def remove_spooled(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+async def run_transcription_job(job_id, path):
+    """
+    Обрабатывает задачу транскрипции. Если тот же файл уже обрабатывается (другой задачей
+    или синхронным запросом), задача ждет общий результат.
+    """
+    try:
+        job = await job_store.get(job_id)
+        roles = await single_flight(job["sha256"], lambda: transcribe_job(job_id, path))
+        job = await job_store.get(job_id)
+        if job["status"] not in FINISHED:
+            await job_store.update(job_id, status=COMPLETED, result=roles)
+    except Exception as e:
+        logger.exception(f"Ошибка в задаче транскрипции {job_id}.")
+        await fail_job(job_id, e)
+    finally:
+        remove_spooled(path)
+
+async def transcribe_job(job_id, path):
+    """
+    Загружает аудио, создает задачу AssemblyAI и ждет завершения задачи. Возвращает роли.
+    Пока задача в очереди AssemblyAI, статус опрашивается с нарастающим интервалом, чтобы измерить время ожидания.
+    Дальше при настроенном вебхуке опрос — только страховка с редким интервалом.
+    """
+    session = get_clients().assemblyai
+    try:
+        # Повторно загруженный файл отдаем из кэша без AssemblyAI и OpenAI
+        job = await job_store.get(job_id)
+        roles = await cached_roles(job["sha256"])
+        if roles is not None:
+            return roles
+
+        # Отметки времени хранятся в задаче: ее может завершить обработчик вебхука
+        started_at = time.time()
+        audio_url = await upload_audio(session, lambda: file_chunks(path))
+    finally:
+        remove_spooled(path)
+
+    url = webhook_url()
+    transcript_id = await request_transcript(session, audio_url, webhook_url=url)
+    job = await job_store.update(
+        job_id,
+        status=TRANSCRIBING,
+        transcript_id=transcript_id,
+        started_at=started_at,
+        requested_at=time.time(),
+        processing_at=None
+    )
+
+    delay = POLL_INITIAL_DELAY
+    queued = True
+    while job["status"] == TRANSCRIBING:
+        job = await job_store.wait_for_change(job_id, job["version"], delay)
+        if job["status"] != TRANSCRIBING:
+            break
+        status_data = await fetch_transcript(session, transcript_id)
+        if queued and status_data['status'] != 'queued':
+            queued = False
+            job = await job_store.update(job_id, processing_at=time.time())
+        if transcript_finished(status_data):
+            await finish_job(job_id, status_data)
+            break
+        delay = WEBHOOK_POLL_DELAY if url and not queued else next_poll_delay(delay)
+
+    # Классификацию мог запустить обработчик вебхука: ждем ее окончания
+    while job is not None and job["status"] not in FINISHED:
+        job = await job_store.wait_for_change(job_id, job["version"], WEBHOOK_POLL_DELAY)
+    if job is None or job["status"] == FAILED:
+        raise HTTPException(status_code=500, detail=job["error"] if job else "Задача удалена")
+    return job["result"]
+
+async def finish_job(job_id, status_data):
+    """
+    Классифицирует роли завершенной транскрипции и сохраняет результат.
+    Обрабатывает задачу только один раз, даже если о завершении сообщили и вебхук, и опрос.
+    """
+    if not await job_store.claim(job_id, TRANSCRIBING, CLASSIFYING):
+        return
+    try:
+        job = await job_store.get(job_id)
+        record_transcript_stages(job, time.time())
+        roles = await process_transcript(status_data, job["sha256"])
+        metrics.STAGE_SECONDS.observe(time.time() - job["started_at"], stage="transcribe")
+        await job_store.update(job_id, status=COMPLETED, result=roles)
+        logger.info(f"Задача {job_id} завершена.")
+    except Exception as e:
+        logger.exception(f"Ошибка классификации в задаче {job_id}.")
+        await fail_job(job_id, e)
+
+def record_transcript_stages(job, completed_at):
+    """
+    Записывает время в очереди AssemblyAI и время обработки, как при синхронной транскрипции.
+    Если вебхук пришел раньше, чем опрос увидел выход из очереди, граница неизвестна и этапы не записываются.
+    """
+    if job.get("processing_at") is None:
+        return
+    metrics.STAGE_SECONDS.observe(job["processing_at"] - job["requested_at"], stage="queue_wait")
+    metrics.STAGE_SECONDS.observe(completed_at - job["processing_at"], stage="processing")
+
+async def fail_job(job_id, error):
+    """
+    Помечает незавершенную задачу как неудачную.
+    """
+    job = await job_store.get(job_id)
+    if job is not None and job["status"] not in FINISHED:
+        await job_store.update(job_id, status=FAILED, error=str(getattr(error, "detail", error)))
+
+async def handle_webhook(transcript_id):
+    """
+    Обрабатывает уведомление AssemblyAI о завершении транскрипции. Возвращает False для неизвестной задачи.
+    """
+    job = await job_store.find_by_transcript(transcript_id)
+    if job is None:
+        return False
+    spawn(complete_from_webhook(job["id"], transcript_id))
+    return True
+
+async def complete_from_webhook(job_id, transcript_id):
+    """
+    Получает результат транскрипции после вебхука и завершает задачу.
+    """
+    session = get_clients().assemblyai
+    try:
+        status_data = await fetch_transcript(session, transcript_id)
+        if transcript_finished(status_data):
+            await finish_job(job_id, status_data)
+    except Exception as e:
+        logger.exception(f"Ошибка обработки вебхука для задачи {job_id}.")
+        await fail_job(job_id, e)
+
+async def job_events(job_id, keepalive=15):
+    """
+    Генерирует события SSE при каждом изменении задачи до ее завершения.
+    """
+    version = None
+    while True:
+        job = await job_store.get(job_id) if version is None else await job_store.wait_for_change(job_id, version, keepalive)
+        if job is None:
+            return
+        if job["version"] == version:
+            yield ": keep-alive\n\n"
+            continue
+        version = job["version"]
+        yield f"event: status\ndata: {json.dumps(job, ensure_ascii=False)}\n\n"
+        if job["status"] in FINISHED:
+            return
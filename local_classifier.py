@@ -0,0 +1,262 @@
+"""
+Локальный классификатор ролей: логистическая регрессия над хешированными символьными n-граммами
+и признаками реплики (вопрос, позиция в диалоге, роль предыдущей реплики, смена спикера).
+Работает на CPU без сети и используется перед запросом к OpenAI.
+
+Обучение на выгруженных размеченных диалогах (JSONL, один диалог на строку):
+    python local_classifier.py train dialogues.jsonl
+    python local_classifier.py evaluate dialogues.jsonl
+"""
+import os
+import re
+import json
+import math
+import time
+import zlib
+import random
+import logging
+import argparse
+from phrase_index import KEY_PHRASES_PATH, PHRASES_RELOAD_INTERVAL, normalize_text
+
+logger = logging.getLogger(__name__)
+
+# Модель хранится рядом с key_phrases.json
+LOCAL_MODEL_PATH = os.getenv(
+    "LOCAL_MODEL_PATH",
+    os.path.join(os.path.dirname(KEY_PHRASES_PATH), "role_model.json")
+)
+
+# Минимальная уверенность модели, при которой не нужен запрос к OpenAI
+LOCAL_CLASSIFIER_THRESHOLD = float(os.getenv("LOCAL_CLASSIFIER_THRESHOLD", "0.85"))
+
+# Размер пространства хешированных признаков и длины символьных n-грамм
+FEATURE_BUCKETS = 1 << 18
+NGRAM_SIZES = (2, 3, 4)
+
+ROLES = ("Клиент", "Менеджер")
+
+def position_bucket(position):
+    if position == 0:
+        return "first"
+    if position < 4:
+        return "early"
+    if position < 12:
+        return "middle"
+    return "late"
+
+def features(text, position=0, previous_role=None, same=None):
+    """
+    Возвращает индексы хешированных признаков реплики.
+    Метка спикера AssemblyAI учитывается через смену спикера: сами метки в разных звонках не сопоставимы.
+    """
+    names = []
+    for word in re.findall(r"\w+", normalize_text(text)):
+        padded = f" {word} "
+        for size in NGRAM_SIZES:
+            names.extend(padded[i:i + size] for i in range(len(padded) - size + 1))
+
+    speaker = {True: "same", False: "other"}.get(same, "?")
+    names.append(f"#question:{'?' in text}")
+    names.append(f"#position:{position_bucket(position)}")
+    names.append(f"#previous:{previous_role}")
+    names.append(f"#speaker:{speaker}")
+    names.append(f"#turn:{previous_role}|{speaker}")
+
+    return {zlib.crc32(name.encode("utf-8")) % FEATURE_BUCKETS for name in names}
+
+class LocalRoleClassifier:
+    """
+    Бинарная логистическая регрессия: вероятность того, что реплику произносит менеджер.
+    """
+
+    def __init__(self, weights=None, bias=0.0):
+        self.weights = weights or {}
+        self.bias = bias
+
+    def probability(self, indices):
+        score = self.bias + sum(self.weights.get(index, 0.0) for index in indices)
+        score = max(-30.0, min(30.0, score))
+        return 1.0 / (1.0 + math.exp(-score))
+
+    def predict(self, text, position=0, previous_role=None, same=None):
+        """
+        Возвращает роль и уверенность модели.
+        """
+        manager = self.probability(features(text, position, previous_role, same))
+        if manager >= 0.5:
+            return "Менеджер", manager
+        return "Клиент", 1.0 - manager
+
+    def train(self, samples, epochs=10, learning_rate=0.2, l2=1e-5, seed=0):
+        """
+        Обучает модель стохастическим градиентным спуском.
+        samples — список (индексы признаков, 1 для менеджера или 0 для клиента).
+        """
+        rng = random.Random(seed)
+        samples = list(samples)
+        for epoch in range(epochs):
+            rng.shuffle(samples)
+            rate = learning_rate / (1 + epoch)
+            loss = 0.0
+            for indices, label in samples:
+                probability = self.probability(indices)
+                likelihood = probability if label else 1.0 - probability
+                loss -= math.log(max(likelihood, 1e-12))
+                gradient = probability - label
+                self.bias -= rate * gradient
+                for index in indices:
+                    weight = self.weights.get(index, 0.0)
+                    self.weights[index] = weight - rate * (gradient + l2 * weight)
+            logger.info(f"Эпоха {epoch + 1}: средняя ошибка {loss / max(len(samples), 1):.4f}")
+
+    def save(self, path):
+        model = {
+            "buckets": FEATURE_BUCKETS,
+            "bias": self.bias,
+            "weights": {str(index): round(weight, 6) for index, weight in self.weights.items() if abs(weight) > 1e-6},
+        }
+        temporary = f"{path}.tmp"
+        with open(temporary, "w", encoding="utf-8") as file:
+            json.dump(model, file)
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as file:
+            model = json.load(file)
+        if model["buckets"] != FEATURE_BUCKETS:
+            raise ValueError("Модель обучена с другим числом признаков")
+        weights = {int(index): weight for index, weight in model["weights"].items()}
+        return cls(weights, model["bias"])
+
+_model = None
+_mtime = None
+_checked_at = 0.0
+
+def get_model():
+    """
+    Возвращает загруженную модель или None, если она еще не обучена.
+    Перечитывает файл модели после переобучения без перезапуска сервиса.
+    """
+    global _model, _mtime, _checked_at
+
+    now = time.monotonic()
+    if _mtime is not None and now - _checked_at < PHRASES_RELOAD_INTERVAL:
+        return _model
+    _checked_at = now
+
+    try:
+        mtime = os.path.getmtime(LOCAL_MODEL_PATH)
+    except OSError:
+        _model, _mtime = None, 0.0
+        return None
+
+    if mtime != _mtime:
+        try:
+            _model = LocalRoleClassifier.load(LOCAL_MODEL_PATH)
+            logger.info(f"Загружена локальная модель ролей {LOCAL_MODEL_PATH}")
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"Не удалось загрузить локальную модель {LOCAL_MODEL_PATH}: {e}")
+            _model = None
+        _mtime = mtime
+    return _model
+
+def local_role(text, position=0, previous_role=None, same=None):
+    """
+    Возвращает роль, если локальная модель уверена в ней не меньше LOCAL_CLASSIFIER_THRESHOLD, иначе None.
+    """
+    model = get_model()
+    if model is None:
+        return None
+    role, confidence = model.predict(text, position, previous_role, same)
+    return role if confidence >= LOCAL_CLASSIFIER_THRESHOLD else None
+
+def load_dialogues(path):
+    """
+    Читает размеченные диалоги: строка JSONL — список реплик либо объект с ключом
+    "utterances" или "transcription". Реплика содержит "text", "role" и, если есть, "speaker".
+    """
+    dialogues = []
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            if not line.strip():
+                continue
+            dialogue = json.loads(line)
+            if isinstance(dialogue, dict):
+                dialogue = dialogue.get("utterances") or dialogue.get("transcription") or []
+            dialogues.append([entry for entry in dialogue if entry.get("role") in ROLES])
+    return dialogues
+
+def dialogue_samples(dialogue):
+    """
+    Превращает диалог в обучающие примеры. Роль предыдущей реплики берется из разметки.
+    """
+    samples = []
+    previous = None
+    for position, entry in enumerate(dialogue):
+        same = None
+        if previous is not None and entry.get("speaker") is not None and previous.get("speaker") is not None:
+            same = entry["speaker"] == previous["speaker"]
+        indices = features(entry["text"], position, previous["role"] if previous else None, same)
+        samples.append((indices, 1 if entry["role"] == "Менеджер" else 0))
+        previous = entry
+    return samples
+
+def evaluate(model, samples, threshold=LOCAL_CLASSIFIER_THRESHOLD):
+    """
+    Возвращает точность на всех примерах, долю уверенных предсказаний и точность на уверенных.
+    """
+    correct = confident = confident_correct = 0
+    for indices, label in samples:
+        manager = model.probability(indices)
+        predicted = 1 if manager >= 0.5 else 0
+        confidence = max(manager, 1.0 - manager)
+        correct += predicted == label
+        if confidence >= threshold:
+            confident += 1
+            confident_correct += predicted == label
+    total = max(len(samples), 1)
+    return {
+        "accuracy": correct / total,
+        "coverage": confident / total,
+        "confident_accuracy": confident_correct / confident if confident else 0.0,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальный классификатор ролей менеджер/клиент")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    train_parser = subparsers.add_parser("train", help="обучить модель на размеченных диалогах")
+    train_parser.add_argument("dialogues", help="JSONL-файл с размеченными диалогами")
+    train_parser.add_argument("--output", default=LOCAL_MODEL_PATH, help="куда сохранить модель")
+    train_parser.add_argument("--epochs", type=int, default=10)
+    train_parser.add_argument("--holdout", type=float, default=0.1, help="доля диалогов для проверки")
+
+    evaluate_parser = subparsers.add_parser("evaluate", help="оценить модель на размеченных диалогах")
+    evaluate_parser.add_argument("dialogues", help="JSONL-файл с размеченными диалогами")
+    evaluate_parser.add_argument("--model", default=LOCAL_MODEL_PATH)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    dialogues = load_dialogues(args.dialogues)
+
+    if args.command == "train":
+        random.Random(0).shuffle(dialogues)
+        split = int(len(dialogues) * args.holdout)
+        holdout, train = dialogues[:split], dialogues[split:]
+
+        model = LocalRoleClassifier()
+        model.train([sample for dialogue in train for sample in dialogue_samples(dialogue)], epochs=args.epochs)
+        model.save(args.output)
+        logger.info(f"Модель сохранена в {args.output}")
+
+        if holdout:
+            samples = [sample for dialogue in holdout for sample in dialogue_samples(dialogue)]
+            logger.info(f"Проверка на {len(holdout)} диалогах: {evaluate(model, samples)}")
+    else:
+        model = LocalRoleClassifier.load(args.model)
+        samples = [sample for dialogue in dialogues for sample in dialogue_samples(dialogue)]
+        logger.info(f"Оценка на {len(dialogues)} диалогах: {evaluate(model, samples)}")
+
+if __name__ == "__main__":
+    main()
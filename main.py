@@ -1,13 +1,31 @@
+import hmac
 import logging
-from fastapi import FastAPI, Response, UploadFile, File
-from repository import transcribe_audio
+from typing import List, Optional
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Response, UploadFile, File, Form, Request, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
+from repository import transcribe_audio, WEBHOOK_SECRET, WEBHOOK_AUTH_HEADER
+from phrase_index import reload_phrases
+from clients import open_clients
+from cache import transcription_cache, role_cache
+import metrics
+from jobs import job_store, start_transcription_job, start_batch_job, handle_webhook, job_events
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app):
+    # Общие HTTP-клиенты живут столько же, сколько приложение
+    role_cache.load()
+    async with open_clients():
+        yield
+    role_cache.save()
+
 app = FastAPI(
-    title="Smart"
+    title="Smart",
+    lifespan=lifespan
 )
 
 @app.get("/")
@@ -18,13 +36,88 @@ async def read_root():
 async def favicon():
     return Response(status_code=204) 
 
+@app.post("/phrases/reload")
+async def phrases_reload():
+    index = reload_phrases()
+    return {"phrases": len(index)}
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return {
+        "transcriptions": transcription_cache.stats(),
+        "roles": role_cache.stats(),
+    }
+
+@app.get("/metrics")
+async def get_metrics():
+    # Показатели кэшей снимаем в момент запроса
+    for name, cache in (("transcriptions", transcription_cache), ("roles", role_cache)):
+        stats = cache.stats()
+        metrics.CACHE_HIT_RATIO.set(stats["hit_rate"], cache=name)
+        metrics.CACHE_ITEMS.set(stats["items"], cache=name)
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.post("/transcribe")
-async def transcribe(file: UploadFile = File(...)):
+async def transcribe(file: UploadFile = File(...), mode: str = "sync"):
     logger.info("Получен файл для транскрипции.")
+
+    # В режиме задачи сразу возвращаем идентификатор, результат — через /jobs/{job_id}
+    if mode == "job":
+        job = await start_transcription_job(file)
+        logger.info(f"Создана задача транскрипции {job['id']}.")
+        return JSONResponse(status_code=202, content={"job_id": job["id"], "status": job["status"]})
+
     try:
         transcription = await transcribe_audio(file)
         logger.info("Транскрипция завершена.")
         return {"transcription": transcription}
     except Exception as e:
         logger.error(f"Ошибка при транскрипции: {e}")
-        return {"error": str(e)}
\ No newline at end of file
+        return {"error": str(e)}
+
+@app.post("/transcribe/batch")
+async def transcribe_batch(
+    files: Optional[List[UploadFile]] = File(None),
+    urls: Optional[List[str]] = Form(None)
+):
+    files = files or []
+    urls = urls or []
+    if not files and not urls:
+        raise HTTPException(status_code=400, detail="Передайте файлы или ссылки на аудио")
+
+    logger.info(f"Получен пакет: файлов {len(files)}, ссылок {len(urls)}.")
+    job = await start_batch_job(files, urls)
+    return JSONResponse(status_code=202, content={"job_id": job["id"], "status": job["status"], "total": len(files) + len(urls)})
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    return job
+
+@app.get("/jobs/{job_id}/events")
+async def get_job_events(job_id: str):
+    if await job_store.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    return StreamingResponse(job_events(job_id), media_type="text/event-stream")
+
+@app.post("/webhooks/assemblyai")
+async def assemblyai_webhook(request: Request):
+    if WEBHOOK_SECRET:
+        received = request.headers.get(WEBHOOK_AUTH_HEADER, "")
+        if not hmac.compare_digest(received.encode("utf-8"), WEBHOOK_SECRET.encode("utf-8")):
+            raise HTTPException(status_code=401, detail="Неверная подпись вебхука")
+
+    try:
+        payload = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Тело вебхука не является JSON")
+    transcript_id = payload.get("transcript_id") if isinstance(payload, dict) else None
+    if not isinstance(transcript_id, str) or not transcript_id:
+        raise HTTPException(status_code=400, detail="В вебхуке нет transcript_id")
+
+    logger.info(f"Вебхук AssemblyAI: {payload}")
+    if not await handle_webhook(transcript_id):
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    return {"status": "ok"}
@@ -0,0 +1,186 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from collections import defaultdict
+
+# Границы корзин гистограмм длительности (в секундах)
+DURATION_BUCKETS = (0.0001, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Границы корзин числа запросов к OpenAI на диалог
+CALLS_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+REGISTRY = []
+
+def format_labels(labelnames, key, extra=""):
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, key)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+    """
+    Монотонно растущий счетчик с метками.
+    """
+    kind = "counter"
+
+    def __init__(self, name, description, labelnames=()):
+        self.name = name
+        self.description = description
+        self.labelnames = labelnames
+        self.values = defaultdict(float)
+        REGISTRY.append(self)
+
+    def key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def inc(self, amount=1, **labels):
+        self.values[self.key(labels)] += amount
+
+    def samples(self):
+        for key, value in sorted(self.values.items()):
+            yield f"{self.name}{format_labels(self.labelnames, key)} {value}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return lines
+
+class Gauge(Counter):
+    """
+    Текущее значение с метками.
+    """
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        self.values[self.key(labels)] = value
+
+class Histogram(Counter):
+    """
+    Гистограмма с накопительными корзинами, суммой и числом наблюдений.
+    """
+    kind = "histogram"
+
+    def __init__(self, name, description, labelnames=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, description, labelnames)
+        self.buckets = buckets
+        self.values = {}
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        series = self.values.setdefault(key, {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0})
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series["buckets"][i] += 1
+        series["sum"] += value
+        series["count"] += 1
+
+    def summary(self, **labels):
+        """
+        Возвращает число наблюдений и их сумму для набора меток.
+        """
+        series = self.values.get(self.key(labels), {"sum": 0.0, "count": 0})
+        return series["count"], series["sum"]
+
+    def samples(self):
+        for key, series in sorted(self.values.items()):
+            bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+            counts = series["buckets"] + [series["count"]]
+            for bound, count in zip(bounds, counts):
+                labels = format_labels(self.labelnames, key, f'le="{bound}"')
+                yield f"{self.name}_bucket{labels} {count}"
+            labels = format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {series['sum']}"
+            yield f"{self.name}_count{labels} {series['count']}"
+
+def render():
+    """
+    Возвращает все метрики в текстовом формате Prometheus.
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+STAGE_SECONDS = Histogram(
+    "smart_stage_seconds",
+    "Длительность этапов обработки звонка",
+    ("stage",)
+)
+LLM_REQUESTS = Counter(
+    "smart_llm_requests_total",
+    "Запросы к OpenAI по видам",
+    ("kind",)
+)
+LLM_TOKENS = Counter(
+    "smart_llm_tokens_sent_total",
+    "Оценка числа токенов, отправленных в OpenAI"
+)
+LLM_CALLS_PER_DIALOGUE = Histogram(
+    "smart_llm_calls_per_dialogue",
+    "Число запросов к OpenAI на один диалог",
+    buckets=CALLS_BUCKETS
+)
+ROLE_DECISIONS = Counter(
+    "smart_role_decisions_total",
+    "Источник решения о роли реплики",
+    ("source",)
+)
+PHRASE_LOOKUPS = Counter(
+    "smart_phrase_lookups_total",
+    "Проверки реплик по ключевым фразам"
+)
+PHRASE_HITS = Counter(
+    "smart_phrase_hits_total",
+    "Проверки, нашедшие хотя бы одну ключевую фразу"
+)
+ASSEMBLYAI_POLLS = Counter(
+    "smart_assemblyai_polls_total",
+    "Запросы статуса транскрипции к AssemblyAI"
+)
+CACHE_HIT_RATIO = Gauge(
+    "smart_cache_hit_ratio",
+    "Доля попаданий в кэш",
+    ("cache",)
+)
+CACHE_ITEMS = Gauge(
+    "smart_cache_items",
+    "Число записей в памяти кэша",
+    ("cache",)
+)
+
+# Счетчик запросов к OpenAI для текущего диалога
+_dialogue_calls = ContextVar("dialogue_calls", default=None)
+
+@contextmanager
+def timed(stage):
+    """
+    Измеряет длительность блока и записывает ее в гистограмму этапов.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage=stage)
+
+@contextmanager
+def dialogue():
+    """
+    Считает запросы к OpenAI внутри блока как запросы одного диалога.
+    """
+    calls = [0]
+    token = _dialogue_calls.set(calls)
+    try:
+        yield
+    finally:
+        _dialogue_calls.reset(token)
+        LLM_CALLS_PER_DIALOGUE.observe(calls[0])
+
+def count_llm_request(kind, tokens):
+    """
+    Учитывает запрос к OpenAI в общих счетчиках и в счетчике текущего диалога.
+    """
+    LLM_REQUESTS.inc(kind=kind)
+    LLM_TOKENS.inc(tokens)
+    calls = _dialogue_calls.get()
+    if calls is not None:
+        calls[0] += 1
@@ -0,0 +1,174 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import deque, namedtuple
+
+logger = logging.getLogger(__name__)
+
+# Путь к файлу ключевых фраз и интервал проверки его изменений (в секундах)
+KEY_PHRASES_PATH = os.getenv("KEY_PHRASES_PATH", "key_phrases.json")
+PHRASES_RELOAD_INTERVAL = float(os.getenv("PHRASES_RELOAD_INTERVAL", "5"))
+
+# Соответствие ключей JSON-файла сторонам диалога
+SIDES = {
+    "manager_phrases": "manager",
+    "client_phrases": "client",
+}
+
+# Найденная фраза: текст фразы, сторона, вес и позиция конца совпадения в тексте
+PhraseHit = namedtuple("PhraseHit", ["phrase", "side", "weight", "end"])
+
+def normalize_text(text):
+    """
+    Нормализует текст для поиска: нижний регистр и замена "ё" на "е".
+    """
+    return text.lower().replace("ё", "е")
+
+class PhraseIndex:
+    """
+    Автомат Ахо-Корасик над нормализованными ключевыми фразами.
+    Находит все вхождения всех фраз за один проход по тексту.
+    """
+
+    def __init__(self, entries):
+        # entries — последовательность (фраза, сторона, вес)
+        self.entries = []
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [()]
+
+        for phrase, side, weight in entries:
+            normalized = normalize_text(phrase).strip()
+            if not normalized:
+                continue
+            self.entries.append(PhraseHit(phrase, side, weight, 0))
+            self._insert(normalized, len(self.entries) - 1)
+
+        self._build_failure_links()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _insert(self, phrase, entry_id):
+        state = 0
+        for char in phrase:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][char] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append(())
+            state = next_state
+        self.output[state] += (entry_id,)
+
+    def _build_failure_links(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                # Наследуем совпадения суффиксов, чтобы не ходить по ссылкам при поиске
+                self.output[next_state] += self.output[self.fail[next_state]]
+
+    def search(self, text):
+        """
+        Возвращает все вхождения ключевых фраз в тексте со стороной и весом.
+        """
+        goto = self.goto
+        fail = self.fail
+        output = self.output
+        entries = self.entries
+
+        hits = []
+        state = 0
+        for position, char in enumerate(normalize_text(text), 1):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for entry_id in output[state]:
+                hits.append(entries[entry_id]._replace(end=position))
+        return hits
+
+    def side_weights(self, text):
+        """
+        Возвращает суммарный вес совпадений по сторонам: {"manager": ..., "client": ...}.
+        """
+        weights = {side: 0.0 for side in SIDES.values()}
+        for hit in self.search(text):
+            weights[hit.side] = weights.get(hit.side, 0.0) + hit.weight
+        return weights
+
+def load_entries(path):
+    """
+    Загружает ключевые фразы из JSON-файла.
+    Фраза задается строкой или объектом {"phrase": ..., "weight": ...}.
+    """
+    with open(path, "r", encoding="utf-8") as file:
+        key_phrases = json.load(file)
+
+    entries = []
+    for key, side in SIDES.items():
+        for item in key_phrases.get(key, []):
+            if isinstance(item, dict):
+                entries.append((item["phrase"], side, float(item.get("weight", 1.0))))
+            else:
+                entries.append((item, side, 1.0))
+    return entries
+
+_lock = threading.Lock()
+_index = None
+_mtime = None
+_checked_at = 0.0
+
+def reload_phrases(path=None):
+    """
+    Перечитывает файл ключевых фраз и атомарно заменяет индекс.
+    При ошибке чтения остается предыдущий индекс.
+    """
+    global _index, _mtime, _checked_at
+
+    path = path or KEY_PHRASES_PATH
+    with _lock:
+        try:
+            mtime = os.path.getmtime(path)
+            index = PhraseIndex(load_entries(path))
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"Не удалось загрузить ключевые фразы из {path}: {e}")
+            if _index is None:
+                raise
+            return _index
+
+        _index = index
+        _mtime = mtime
+        _checked_at = time.monotonic()
+        logger.info(f"Загружено ключевых фраз: {len(index)}")
+        return index
+
+def get_index():
+    """
+    Возвращает текущий индекс ключевых фраз.
+    Не чаще раза в PHRASES_RELOAD_INTERVAL секунд проверяет, изменился ли файл, и перезагружает его.
+    """
+    global _checked_at
+
+    if _index is None:
+        return reload_phrases()
+
+    now = time.monotonic()
+    if now - _checked_at >= PHRASES_RELOAD_INTERVAL:
+        _checked_at = now
+        try:
+            changed = os.path.getmtime(KEY_PHRASES_PATH) != _mtime
+        except OSError:
+            changed = False
+        if changed:
+            return reload_phrases()
+
+    return _index
@@ -1,12 +1,18 @@
 import os
+import re
+import time
 import asyncio
 import logging
 import json
+import hashlib
 from dotenv import load_dotenv
 from fastapi import HTTPException
-import aiohttp
-import httpx
-import openai
+import phrase_index
+import metrics
+from cache import transcription_cache, role_cache
+from clients import get_clients
+from local_classifier import local_role
+from scheduler import rate_limits, TransientError, is_transient, retry_after_seconds, with_retries
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -15,44 +21,61 @@ logger = logging.getLogger(__name__)
 load_dotenv()
 
 # Загружаем API-ключи
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-PROXY_URL = os.getenv("PROXY_URL")
 ASSEMBLYAI_API_KEY = os.getenv("ASSEMBLYAI_API_KEY")
 
-# Загружаем ключевые фразы из JSON-файла
-with open("key_phrases.json", "r", encoding="utf-8") as file:
-    key_phrases = json.load(file)
+ASSEMBLYAI_URL = os.getenv("ASSEMBLYAI_URL", "https://api.assemblyai.com/v2")
 
-MANAGER_PHRASES = key_phrases["manager_phrases"]
-CLIENT_PHRASES = key_phrases["client_phrases"]
+# Размер фрагмента при чтении и загрузке аудиофайла
+UPLOAD_CHUNK_SIZE = 1024 * 1024
 
-# Счетчик реплик для определения порядка приветствий
-greeting_counter = 0
+# Интервалы опроса статуса транскрипции: начальный, максимальный и множитель
+POLL_INITIAL_DELAY = float(os.getenv("POLL_INITIAL_DELAY", "1"))
+POLL_MAX_DELAY = float(os.getenv("POLL_MAX_DELAY", "15"))
+POLL_BACKOFF = 1.5
 
-# Настройка OpenAI с прокси
-openai.api_key = OPENAI_API_KEY
-openai.proxy = PROXY_URL
+# Вебхук AssemblyAI: публичный адрес сервиса и секрет для проверки запросов
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_AUTH_HEADER = "X-Webhook-Secret"
 
-async def openai_request(text, context=None):
-    """
-    Отправляет запрос к OpenAI для определения роли (менеджер/клиент).
-    """
-    messages = []
-    if context:
-        for entry in context:
-            messages.append({
-                "role": "system",
-                "content": f"{entry['role']}: {entry['text']}"
-            })
-    
-    messages.append({
-    "role": "user",
-    "content": f"""
-    Ты — опытный ИИ-аналитик, который специализируется на анализе диалогов между менеджером и клиентом. Твоя задача — определить, кто говорит в следующей фразе: менеджер или клиент.
+# Загружаем индекс ключевых фраз (файл перечитывается при изменении)
+phrase_index.get_index()
 
-    Контекст диалога:
-    {context if context else "Контекст отсутствует."}
+# Решение по ключевым фразам: "priority" — любая фраза менеджера означает менеджера, иначе фраза клиента;
+# "weighted" — побеждает сторона с большим суммарным весом совпадений (при равенстве — менеджер)
+PHRASE_DECISION = os.getenv("PHRASE_DECISION", "priority")
+
+# Режим классификации ролей: "batch" — окнами реплик, "utterance" — по одной реплике,
+# "speaker" — одна роль на метку спикера AssemblyAI
+CLASSIFICATION_MODE = os.getenv("CLASSIFICATION_MODE", "batch")
+
+# Короткие реплики (не длиннее стольких слов, без вопроса) считаются поддакиванием
+# и определяются по предыдущей реплике без запроса к OpenAI
+BACKCHANNEL_MAX_WORDS = int(os.getenv("BACKCHANNEL_MAX_WORDS", "2"))
+
+# Голосование OpenAI по спикеру в режиме "speaker" (один запрос на спикера)
+SPEAKER_LLM_VOTE = os.getenv("SPEAKER_LLM_VOTE", "0") == "1"
+
+# Веса признаков при выборе роли спикера
+SPEAKER_WEIGHTS = {
+    "phrase": 1.0,
+    "greeting": 2.0,
+    "question": 2.0,
+    "vote": 3.0,
+}
+
+# Ограничения пакетной классификации и скользящего контекста
+BATCH_MAX_UTTERANCES = int(os.getenv("BATCH_MAX_UTTERANCES", "40"))
+BATCH_TOKEN_BUDGET = int(os.getenv("BATCH_TOKEN_BUDGET", "1500"))
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "800"))
+
+# Лимиты токенов ответа OpenAI (max_tokens). Квота токенов списывается по этим лимитам.
+# Ответ из одного слова и JSON пакетного ответа: запас на скобки плюс токены на каждую неразмеченную реплику.
+OPENAI_ROLE_COMPLETION_TOKENS = int(os.getenv("OPENAI_ROLE_COMPLETION_TOKENS", "10"))
+OPENAI_BATCH_COMPLETION_TOKENS = int(os.getenv("OPENAI_BATCH_COMPLETION_TOKENS", "10"))
+OPENAI_BATCH_TOKENS_PER_LINE = int(os.getenv("OPENAI_BATCH_TOKENS_PER_LINE", "12"))
 
+ROLE_RULES = """
     Учти следующие правила:
     1. Первое приветствие в диалоге всегда говорит менеджер.
     2. Менеджер чаще задает вопросы, уточняет информацию, предлагает услуги или продукты.
@@ -61,147 +84,781 @@ async def openai_request(text, context=None):
     5. Если фраза содержит предложение помощи, уточнение или вопрос о потребностях клиента, то это менеджер.
     6. Первое прощание скорее всего от менеджера.
     7. После вопроса "Как я могу к вам обращаться?" имя называет клиент.
+"""
+
+def estimate_tokens(text):
+    """
+    Грубо оценивает число токенов в тексте (для кириллицы около трех символов на токен).
+    """
+    return len(text) // 3 + 1
+
+def trim_context(context, budget=CONTEXT_TOKEN_BUDGET):
+    """
+    Оставляет последние реплики контекста, которые укладываются в бюджет токенов.
+    """
+    trimmed = []
+    used = 0
+    for entry in reversed(context):
+        used += estimate_tokens(entry['text'])
+        if used > budget:
+            break
+        trimmed.append(entry)
+    trimmed.reverse()
+    return trimmed
+
+def format_context(context):
+    """
+    Форматирует контекст диалога в текст для промпта.
+    """
+    if not context:
+        return "Контекст отсутствует."
+    return "\n".join(f"{entry['role']}: {entry['text']}" for entry in context)
+
+def normalize_role(answer):
+    """
+    Приводит ответ модели к "Менеджер" или "Клиент". Возвращает None для неожиданного ответа.
+    """
+    if "Менеджер" in answer:
+        return "Менеджер"
+    if "Клиент" in answer:
+        return "Клиент"
+    return None
+
+async def chat_completion(messages, kind="utterance", max_tokens=OPENAI_ROLE_COMPLETION_TOKENS):
+    """
+    Выполняет запрос к OpenAI Chat Completions через общий пул соединений
+    с учетом квот OpenAI и повторами при 429 и 5xx.
+    Ответ ограничен max_tokens, и этот же лимит списывается с квоты токенов.
+    """
+    prompt_tokens = sum(estimate_tokens(message['content']) for message in messages)
+
+    async def send():
+        await rate_limits.openai(prompt_tokens + max_tokens)
+        metrics.count_llm_request(kind, prompt_tokens)
+        with metrics.timed(f"openai_{kind}"):
+            response = await get_clients().openai.post(
+                "/chat/completions",
+                json={"model": "gpt-3.5-turbo", "messages": messages, "max_tokens": max_tokens}
+            )
+        if is_transient(response.status_code):
+            raise TransientError(response.status_code, response.text, retry_after_seconds(response.headers))
+        response.raise_for_status()
+        return response.json()
+
+    try:
+        return await with_retries(send)
+    except Exception as e:
+        logger.error(f"Ошибка при запросе к OpenAI: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def openai_request(text, context=None):
+    """
+    Отправляет запрос к OpenAI для определения роли (менеджер/клиент).
+    """
+    messages = [{
+    "role": "user",
+    "content": f"""
+    Ты — опытный ИИ-аналитик, который специализируется на анализе диалогов между менеджером и клиентом. Твоя задача — определить, кто говорит в следующей фразе: менеджер или клиент.
 
+    Контекст диалога:
+    {format_context(context)}
+    {ROLE_RULES}
     Теперь определи роль для следующей фразы:
     Текст: "{text}"
     Роль:
 
     Верни только одно слово: "Менеджер" или "Клиент". Ничего больше не пиши. Не добавляй рассуждения.
     """
-})
-    
+}]
+    return await chat_completion(messages, "utterance")
+
+async def openai_batch_request(lines, context=None):
+    """
+    Отправляет к OpenAI окно реплик и запрашивает роли неразмеченных реплик в формате JSON.
+    lines — список кортежей (номер, известная роль или None, текст).
+    """
+    dialogue = "\n".join(f"{number}. [{role or '?'}] {text}" for number, role, text in lines)
+    messages = [{
+    "role": "user",
+    "content": f"""
+    Ты — опытный ИИ-аналитик, который специализируется на анализе диалогов между менеджером и клиентом. Твоя задача — определить, кто говорит в каждой из пронумерованных фраз: менеджер или клиент.
+
+    Предыдущая часть диалога:
+    {format_context(context)}
+    {ROLE_RULES}
+    Следующие фразы диалога. Если роль указана в квадратных скобках, она уже известна. Для фраз с пометкой [?] определи роль:
+{dialogue}
+
+    Верни только JSON-объект вида {{"<номер фразы>": "Менеджер" или "Клиент"}} для каждой фразы с пометкой [?]. Ничего больше не пиши. Не добавляй рассуждения.
+    """
+}]
+    pending = sum(1 for _, role, _ in lines if role is None)
+    max_tokens = OPENAI_BATCH_COMPLETION_TOKENS + OPENAI_BATCH_TOKENS_PER_LINE * pending
+    return await chat_completion(messages, "batch", max_tokens)
+
+def parse_batch_roles(content, expected):
+    """
+    Разбирает JSON-ответ пакетной классификации.
+    Возвращает словарь {номер: роль} только для корректно размеченных номеров из expected.
+    """
+    start = content.find("{")
+    end = content.rfind("}")
+    if start == -1 or end < start:
+        return {}
     try:
-        response = await openai.ChatCompletion.acreate(
-            model="gpt-3.5-turbo",
-            messages=messages,
-            proxy=PROXY_URL
-        )
-        return response
-    except Exception as e:
-        logger.error(f"Ошибка при запросе к OpenAI: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        data = json.loads(content[start:end + 1])
+    except json.JSONDecodeError:
+        return {}
+    if not isinstance(data, dict):
+        return {}
+
+    roles = {}
+    for number in expected:
+        role = normalize_role(str(data.get(str(number), "")))
+        if role is not None:
+            roles[number] = role
+    return roles
 
-async def predict_role_with_openai(text, context=None):
+def is_greeting(lowered):
     """
-    Определяет роль (менеджер/клиент) для текста с использованием OpenAI и контекста.
+    Проверяет, содержит ли нормализованная фраза приветствие.
+    """
+    return "здравствуйте" in lowered or "добрый день" in lowered
+
+class DialogueSession:
+    """
+    Состояние эвристик в пределах одного диалога, например порядок приветствий.
+    Создается на каждую классификацию, поэтому параллельные запросы не мешают друг другу.
+    """
+
+    def __init__(self):
+        self.greeting_counter = 0
+
+def phrase_role(weights):
+    """
+    Выбирает роль по весам совпадений ключевых фраз с учетом PHRASE_DECISION.
+    """
+    if PHRASE_DECISION == "weighted":
+        return "Менеджер" if weights["manager"] >= weights["client"] else "Клиент"
+    return "Менеджер" if weights["manager"] > 0 else "Клиент"
+
+def heuristic_role(text, session):
+    """
+    Определяет роль по ключевым фразам и порядку приветствий. Возвращает None, если правила не сработали.
+    """
+    lowered = phrase_index.normalize_text(text)
+
+    # Проверяем ключевые фразы за один проход
+    with metrics.timed("phrase_matching"):
+        weights = phrase_index.get_index().side_weights(text)
+    metrics.PHRASE_LOOKUPS.inc()
+    if weights["manager"] > 0 or weights["client"] > 0:
+        metrics.PHRASE_HITS.inc()
+        metrics.ROLE_DECISIONS.inc(source="phrase")
+        return phrase_role(weights)
+
+    # Если ключевые фразы не найдены, используем порядок приветствий
+    if is_greeting(lowered):
+        session.greeting_counter += 1
+        if session.greeting_counter == 1:
+            metrics.ROLE_DECISIONS.inc(source="greeting")
+            return "Менеджер"  # Первое приветствие — менеджер
+        elif session.greeting_counter == 2:
+            metrics.ROLE_DECISIONS.inc(source="greeting")
+            return "Клиент"  # Второе приветствие — клиент
+
+    return None
+
+def opposite_role(role):
+    return "Клиент" if role == "Менеджер" else "Менеджер"
+
+def same_speaker(entry, previous):
+    """
+    Проверяет, произнесены ли две реплики одним спикером. Возвращает None, если меток спикеров нет.
+    """
+    if previous is None or entry.get('speaker') is None or previous.get('speaker') is None:
+        return None
+    return entry['speaker'] == previous['speaker']
+
+def prediction_key(text, previous_role, same):
+    """
+    Ключ кэша предсказаний: нормализованный текст без пунктуации и отпечаток контекста —
+    роль предыдущей реплики и смена спикера.
+    """
+    words = " ".join(re.findall(r"\w+", phrase_index.normalize_text(text)))
+    speaker = {True: "same", False: "other"}.get(same, "?")
+    return f"{words}|{previous_role or '-'}|{speaker}"
+
+def backchannel_role(text, previous_role, same):
+    """
+    Определяет роль короткой реплики-поддакивания ("Да, конечно", "Хорошо") по предыдущей реплике:
+    тот же спикер — та же роль, иначе — противоположная.
+    """
+    if previous_role is None or "?" in text:
+        return None
+    if len(re.findall(r"\w+", text)) > BACKCHANNEL_MAX_WORDS:
+        return None
+    return previous_role if same else opposite_role(previous_role)
+
+def cached_prediction(text, previous_role, same):
+    """
+    Ищет роль в кэше предсказаний, затем пробует правило поддакивания.
+    Возвращает ключ кэша и роль (None, если нужен запрос к OpenAI).
     """
-    global greeting_counter
+    key = prediction_key(text, previous_role, same)
+    role = role_cache.get(key)
+    if role is not None:
+        metrics.ROLE_DECISIONS.inc(source="cache")
+        return key, role
 
+    role = backchannel_role(text, previous_role, same)
+    if role is not None:
+        role_cache.backchannel_hits += 1
+        metrics.ROLE_DECISIONS.inc(source="backchannel")
+    return key, role
+
+async def llm_role(text, context=None, key=None):
+    """
+    Определяет роль для одной реплики запросом к OpenAI. Ответ модели сохраняется в кэш предсказаний по key.
+    """
     try:
-        # Проверяем ключевые фразы менеджера
-        if any(phrase in text.lower() for phrase in MANAGER_PHRASES):
-            return "Менеджер"
-
-        # Проверяем ключевые фразы клиента
-        if any(phrase in text.lower() for phrase in CLIENT_PHRASES):
-            return "Клиент"
-
-        # Если ключевые фразы не найдены, используем порядок приветствий
-        if "здравствуйте" in text.lower() or "добрый день" in text.lower():
-            greeting_counter += 1
-            if greeting_counter == 1:
-                return "Менеджер"  # Первое приветствие — менеджер
-            elif greeting_counter == 2:
-                return "Клиент"  # Второе приветствие — клиент
-
-        # Если порядок приветствий не помогает, используем OpenAI с контекстом
-        response = await openai_request(text, context)
+        response = await openai_request(text, trim_context(context or []))
         logger.info(f"Ответ OpenAI: {response}")  # Логируем полный ответ
-        
+
         # Извлекаем роль из поля content
         role = response["choices"][0]["message"]["content"].strip()
-        
+
         # Очищаем ответ: оставляем только "Менеджер" или "Клиент"
-        if "Менеджер" in role:
-            return "Менеджер"
-        elif "Клиент" in role:
-            return "Клиент"
-        else:
+        normalized = normalize_role(role)
+        if normalized is None:
             logger.warning(f"OpenAI вернул неожиданную роль: '{role}'. Использую значение по умолчанию.")
             return "Клиент"  # По умолчанию
+        if key is not None:
+            role_cache.remember(key, normalized)
+        metrics.ROLE_DECISIONS.inc(source="llm")
+        return normalized
     except Exception as e:
         logger.error(f"Ошибка при определении роли: {e}")
         return "Клиент"  # По умолчанию
 
-async def classify_roles_with_openai(transcription):
+def local_prediction(text, position, previous_role, same):
     """
-    Классифицирует роли для каждой фразы в транскрипции с использованием OpenAI.
+    Ищет роль в кэше предсказаний и правиле поддакивания, затем спрашивает локальную модель.
+    Возвращает ключ кэша и роль (None, если нужен запрос к OpenAI).
+    """
+    key, role = cached_prediction(text, previous_role, same)
+    if role is None:
+        with metrics.timed("local_classifier"):
+            role = local_role(text, position, previous_role, same)
+        if role is not None:
+            metrics.ROLE_DECISIONS.inc(source="local")
+    return key, role
+
+async def predict_role_with_openai(text, context=None, session=None, same=None):
+    """
+    Определяет роль (менеджер/клиент) для текста с использованием OpenAI и контекста.
+    same — произнесена ли фраза тем же спикером, что и предыдущая (None, если неизвестно).
+    """
+    role = heuristic_role(text, session or DialogueSession())
+    if role is not None:
+        return role
+
+    # Повторяющиеся и короткие реплики берем из кэша, остальные пробуем локальной моделью
+    previous_role = context[-1]['role'] if context else None
+    position = len(context) if context else 0
+    key, role = local_prediction(text, position, previous_role, same)
+    if role is not None:
+        return role
+
+    # Если правила не помогают, используем OpenAI с контекстом
+    return await llm_role(text, context, key)
+
+async def classify_roles_per_utterance(transcription, session):
+    """
+    Классифицирует роли, отправляя в OpenAI каждую фразу отдельным запросом.
     """
     classified = []
     context = []  # Сохраняем контекст диалога
 
+    previous = None
+
     for entry in transcription:
         text = entry['text']
-        
-        # Определяем роль с учетом всего контекста
-        role = await predict_role_with_openai(text, context)
+
+        # Определяем роль с учетом скользящего контекста
+        role = await predict_role_with_openai(text, context, session, same_speaker(entry, previous))
+        previous = entry
         logger.info(f"Текст: '{text}' -> Роль: '{role}'")  # Логируем результат
-        
+
         # Добавляем текущую реплику в контекст
         context.append({"role": role, "text": text})
-        
+
         # Сохраняем результат
         classified.append({"role": role, "text": text})
 
     return classified
 
-async def transcribe_audio(file_obj):
+def next_window(transcription, start):
     """
-    Транскрибирует аудиофайл с помощью AssemblyAI и возвращает транскрипцию.
+    Возвращает окно реплик, начиная с start, ограниченное числом реплик и бюджетом токенов.
     """
-    upload_url = "https://api.assemblyai.com/v2/upload"
-    transcript_url = "https://api.assemblyai.com/v2/transcript"
-    
-    async with aiohttp.ClientSession() as session:
-        try:
-            logger.info("Загрузка аудиофайла.")
+    window = []
+    used = 0
+    for entry in transcription[start:]:
+        cost = estimate_tokens(entry['text'])
+        if window and (len(window) >= BATCH_MAX_UTTERANCES or used + cost > BATCH_TOKEN_BUDGET):
+            break
+        window.append(entry)
+        used += cost
+    return window
+
+async def classify_roles_batched(transcription, session):
+    """
+    Классифицирует роли окнами реплик: один запрос к OpenAI на окно вместо запроса на каждую фразу.
+    Фразы, для которых ответ не содержит роли, классифицируются по одной.
+    Если сам запрос не удался (429, 5xx, таймаут), неразмеченные фразы окна получают роль по умолчанию
+    без дополнительных запросов, чтобы не умножать нагрузку при исчерпанной квоте.
+    """
+    classified = []
+    start = 0
+
+    def previous_turn(i):
+        # Предыдущая реплика и ее роль для i-й фразы текущего окна
+        if i:
+            return window[i - 1], roles[i - 1]
+        if start:
+            return transcription[start - 1], classified[-1]['role']
+        return None, None
+
+    while start < len(transcription):
+        window = next_window(transcription, start)
+        context = trim_context(classified)
+
+        # Сначала применяем ключевые фразы и порядок приветствий
+        roles = [heuristic_role(entry['text'], session) for entry in window]
+
+        # Затем кэш предсказаний и локальная модель, если известна роль предыдущей фразы
+        for i, entry in enumerate(window):
+            previous, previous_role = previous_turn(i)
+            if roles[i] is None and (previous_role is not None or previous is None):
+                _, roles[i] = local_prediction(entry['text'], start + i, previous_role, same_speaker(entry, previous))
+
+        pending = [i for i, role in enumerate(roles) if role is None]
+
+        if pending:
+            lines = [(i + 1, role, entry['text']) for i, (role, entry) in enumerate(zip(roles, window))]
+            try:
+                response = await openai_batch_request(lines, context)
+            except Exception as e:
+                logger.error(f"Ошибка пакетного запроса к OpenAI: {e}. Использую значение по умолчанию для окна.")
+                response = None
+
+            if response is None:
+                predicted = {i + 1: "Клиент" for i in pending}  # По умолчанию
+                metrics.ROLE_DECISIONS.inc(len(pending), source="default")
+            else:
+                try:
+                    content = response["choices"][0]["message"]["content"]
+                except (KeyError, IndexError, TypeError):
+                    logger.error(f"Неожиданный ответ OpenAI: {response}")
+                    content = ""
+                predicted = parse_batch_roles(content, [i + 1 for i in pending])
+
+            for i in pending:
+                previous, previous_role = previous_turn(i)
+                key = prediction_key(window[i]['text'], previous_role, same_speaker(window[i], previous))
+
+                role = predicted.get(i + 1)
+                if role is None:
+                    logger.warning(f"Пакетный ответ не содержит роль для фразы '{window[i]['text']}'. Классифицирую отдельно.")
+                    window_context = [{"role": roles[j], "text": window[j]['text']} for j in range(i)]
+                    role = await llm_role(window[i]['text'], classified + window_context, key)
+                elif response is not None:
+                    role_cache.remember(key, role)
+                    metrics.ROLE_DECISIONS.inc(source="llm_batch")
+                roles[i] = role
+
+        for role, entry in zip(roles, window):
+            logger.info(f"Текст: '{entry['text']}' -> Роль: '{role}'")  # Логируем результат
+            classified.append({"role": role, "text": entry['text']})
+
+        start += len(window)
+
+    return classified
+
+async def openai_speaker_request(lines):
+    """
+    Отправляет к OpenAI фразы одного спикера и запрашивает его роль (менеджер/клиент).
+    """
+    phrases = "\n".join(f"- {text}" for text in lines)
+    messages = [{
+    "role": "user",
+    "content": f"""
+    Ты — опытный ИИ-аналитик, который специализируется на анализе диалогов между менеджером и клиентом. Твоя задача — определить, кем является участник диалога, которому принадлежат все следующие фразы: менеджером или клиентом.
+    {ROLE_RULES}
+    Фразы участника:
+{phrases}
+
+    Верни только одно слово: "Менеджер" или "Клиент". Ничего больше не пиши. Не добавляй рассуждения.
+    """
+}]
+    return await chat_completion(messages, "speaker")
+
+async def speaker_llm_vote(lines):
+    """
+    Запрашивает у OpenAI роль спикера по выборке его фраз в пределах бюджета токенов.
+    Возвращает None, если ответ получить не удалось.
+    """
+    sample = []
+    used = 0
+    for text in lines:
+        used += estimate_tokens(text)
+        if sample and used > BATCH_TOKEN_BUDGET:
+            break
+        sample.append(text)
+
+    try:
+        response = await openai_speaker_request(sample)
+        role = response["choices"][0]["message"]["content"].strip()
+        return normalize_role(role)
+    except Exception as e:
+        logger.error(f"Ошибка при голосовании OpenAI по спикеру: {e}")
+        return None
+
+def collect_speaker_evidence(transcription):
+    """
+    Собирает признаки роли для каждой метки спикера: совпадения ключевых фраз,
+    первое приветствие и количество вопросов.
+    """
+    index = phrase_index.get_index()
+    evidence = {}
+    greeted = False
+
+    for entry in transcription:
+        speaker = entry['speaker']
+        lowered = phrase_index.normalize_text(entry['text'])
+        stats = evidence.setdefault(speaker, {
+            "utterances": 0,
+            "manager_hits": 0,
+            "client_hits": 0,
+            "questions": 0,
+            "first_greeting": False,
+        })
+
+        stats["utterances"] += 1
+        weights = index.side_weights(entry['text'])
+        stats["manager_hits"] += weights["manager"]
+        stats["client_hits"] += weights["client"]
+        if "?" in lowered:
+            stats["questions"] += 1
+
+        # Первое приветствие в диалоге говорит менеджер
+        if not greeted and is_greeting(lowered):
+            stats["first_greeting"] = True
+            greeted = True
+
+    return evidence
+
+def speaker_score(stats, vote=None):
+    """
+    Считает оценку "менеджерскости" спикера: чем больше, тем вероятнее, что это менеджер.
+    """
+    score = SPEAKER_WEIGHTS["phrase"] * (stats["manager_hits"] - stats["client_hits"])
+    score += SPEAKER_WEIGHTS["question"] * stats["questions"] / stats["utterances"]
+    if stats["first_greeting"]:
+        score += SPEAKER_WEIGHTS["greeting"]
+    if vote == "Менеджер":
+        score += SPEAKER_WEIGHTS["vote"]
+    elif vote == "Клиент":
+        score -= SPEAKER_WEIGHTS["vote"]
+    return score
+
+async def classify_roles_by_speaker(transcription, session):
+    """
+    Определяет роль один раз для каждой метки спикера AssemblyAI и применяет ее ко всем его фразам.
+    Если меток спикеров нет или спикер один, используется пакетная классификация.
+    """
+    speakers = {entry.get('speaker') for entry in transcription}
+    if None in speakers or len(speakers) < 2:
+        logger.warning("Метки спикеров недоступны. Использую пакетную классификацию.")
+        return await classify_roles_batched(transcription, session)
+
+    evidence = collect_speaker_evidence(transcription)
+    scores = {}
+    for speaker, stats in evidence.items():
+        vote = None
+        if SPEAKER_LLM_VOTE:
+            lines = [entry['text'] for entry in transcription if entry['speaker'] == speaker]
+            vote = await speaker_llm_vote(lines)
+        scores[speaker] = speaker_score(stats, vote)
+        logger.info(f"Спикер {speaker}: признаки {stats}, голос OpenAI: {vote}, оценка: {scores[speaker]:.2f}")
+
+    # Менеджер — спикер с наибольшей оценкой, остальные — клиенты
+    manager = max(scores, key=scores.get)
+    speaker_roles = {
+        speaker: "Менеджер" if speaker == manager else "Клиент"
+        for speaker in scores
+    }
+    metrics.ROLE_DECISIONS.inc(len(transcription), source="speaker")
+
+    return [
+        {"role": speaker_roles[entry['speaker']], "text": entry['text']}
+        for entry in transcription
+    ]
+
+async def classify_roles_with_openai(transcription):
+    """
+    Классифицирует роли для каждой фразы в транскрипции с использованием OpenAI.
+    """
+    session = DialogueSession()
+    with metrics.dialogue(), metrics.timed("classification"):
+        if CLASSIFICATION_MODE == "speaker":
+            return await classify_roles_by_speaker(transcription, session)
+        if CLASSIFICATION_MODE == "utterance":
+            return await classify_roles_per_utterance(transcription, session)
+        return await classify_roles_batched(transcription, session)
+
+def assemblyai_headers():
+    """
+    Возвращает заголовки авторизации AssemblyAI.
+    """
+    return {"authorization": ASSEMBLYAI_API_KEY}
+
+def check_transient(response):
+    """
+    Вызывает TransientError для ответов AssemblyAI с кодом 429 или 5xx.
+    """
+    if is_transient(response.status):
+        raise TransientError(response.status, response.reason, retry_after_seconds(response.headers))
+
+async def upload_audio(session, open_audio):
+    """
+    Загружает аудио в AssemblyAI и возвращает URL загруженного файла.
+    open_audio() возвращает данные для загрузки и вызывается заново при каждой повторной попытке.
+    """
+    async def send():
+        await rate_limits.assemblyai_uploads.acquire()
+        logger.info("Загрузка аудиофайла.")
+        with metrics.timed("upload"):
             async with session.post(
-                upload_url,
-                headers={"authorization": ASSEMBLYAI_API_KEY},
-                data=file_obj.file
+                f"{ASSEMBLYAI_URL}/upload",
+                headers=assemblyai_headers(),
+                data=open_audio()
             ) as upload_response:
+                check_transient(upload_response)
                 if upload_response.status != 200:
                     logger.error("Ошибка загрузки аудиофайла: %s", upload_response.status)
                     raise HTTPException(status_code=upload_response.status, detail="Ошибка загрузки аудиофайла")
-                
+
                 upload_data = await upload_response.json()
-                audio_url = upload_data['upload_url']
-                
-                logger.info("Запрос транскрипции.")
-                transcript_request = {
-                    "audio_url": audio_url,
-                    "language_code": "ru",
-                    "speaker_labels": True
-                }
-                
-                async with session.post(
-                    transcript_url,
-                    headers={"authorization": ASSEMBLYAI_API_KEY},
-                    json=transcript_request
-                ) as transcript_response:
-                    transcript_data = await transcript_response.json()
-                    transcript_id = transcript_data['id']
-                    
-                    while True:
-                        await asyncio.sleep(5)
-                        status_response = await session.get(
-                            f"{transcript_url}/{transcript_id}",
-                            headers={"authorization": ASSEMBLYAI_API_KEY}
-                        )
-                        status_data = await status_response.json()
-                        
-                        if status_data['status'] == 'completed':
-                            logger.info("Транскрипция успешно завершена.")
-                            formatted_transcription = format_transcription(status_data['words'])
-                            roles = await classify_roles_with_openai(formatted_transcription)
-                            return roles
-                        elif status_data['status'] == 'failed':
-                            logger.error("Транскрипция не удалась.")
-                            raise HTTPException(status_code=500, detail="Транскрипция не удалась")
-        
-        except Exception as e:
-            logger.exception("Во время транскрипции произошла ошибка.")
-            raise HTTPException(status_code=500, detail=str(e))
+                return upload_data['upload_url']
+
+    return await with_retries(send)
+
+async def request_transcript(session, audio_url, webhook_url=None):
+    """
+    Создает задачу транскрипции в AssemblyAI и возвращает ее идентификатор.
+    Если указан webhook_url, AssemblyAI сообщит о завершении задачи вебхуком.
+    """
+    logger.info("Запрос транскрипции.")
+    transcript_request = {
+        "audio_url": audio_url,
+        "language_code": "ru",
+        "speaker_labels": True
+    }
+    if webhook_url:
+        transcript_request["webhook_url"] = webhook_url
+        if WEBHOOK_SECRET:
+            transcript_request["webhook_auth_header_name"] = WEBHOOK_AUTH_HEADER
+            transcript_request["webhook_auth_header_value"] = WEBHOOK_SECRET
+
+    async def send():
+        await rate_limits.assemblyai_jobs.acquire()
+        with metrics.timed("transcript_request"):
+            async with session.post(
+                f"{ASSEMBLYAI_URL}/transcript",
+                headers=assemblyai_headers(),
+                json=transcript_request
+            ) as transcript_response:
+                check_transient(transcript_response)
+                transcript_data = await transcript_response.json()
+                if transcript_response.status != 200:
+                    logger.error("Ошибка запроса транскрипции: %s", transcript_response.status)
+                    raise HTTPException(status_code=transcript_response.status, detail=str(transcript_data))
+                return transcript_data['id']
+
+    return await with_retries(send)
+
+async def fetch_transcript(session, transcript_id):
+    """
+    Получает текущее состояние задачи транскрипции.
+    """
+    async def send():
+        metrics.ASSEMBLYAI_POLLS.inc()
+        async with session.get(
+            f"{ASSEMBLYAI_URL}/transcript/{transcript_id}",
+            headers=assemblyai_headers()
+        ) as status_response:
+            check_transient(status_response)
+            return await status_response.json()
+
+    return await with_retries(send)
+
+def transcript_finished(status_data):
+    """
+    Проверяет, завершилась ли задача транскрипции. Для неудачной задачи вызывает HTTPException.
+    """
+    if status_data['status'] == 'completed':
+        logger.info("Транскрипция успешно завершена.")
+        return True
+    if status_data['status'] in ('error', 'failed'):
+        logger.error("Транскрипция не удалась: %s", status_data.get('error'))
+        raise HTTPException(status_code=500, detail="Транскрипция не удалась")
+    return False
+
+def next_poll_delay(delay):
+    """
+    Увеличивает интервал опроса статуса с экспоненциальной задержкой.
+    """
+    return min(delay * POLL_BACKOFF, POLL_MAX_DELAY)
+
+async def wait_for_transcript(session, transcript_id):
+    """
+    Ожидает завершения транскрипции, опрашивая статус с нарастающим интервалом.
+    Время в очереди AssemblyAI и время обработки учитываются отдельными этапами.
+    """
+    delay = POLL_INITIAL_DELAY
+    started = time.perf_counter()
+    queued = True
+    while True:
+        await asyncio.sleep(delay)
+        status_data = await fetch_transcript(session, transcript_id)
+        if queued and status_data['status'] != 'queued':
+            queued = False
+            metrics.STAGE_SECONDS.observe(time.perf_counter() - started, stage="queue_wait")
+            started = time.perf_counter()
+        if transcript_finished(status_data):
+            metrics.STAGE_SECONDS.observe(time.perf_counter() - started, stage="processing")
+            return status_data
+        delay = next_poll_delay(delay)
+
+async def process_transcript(status_data, digest=None):
+    """
+    Форматирует завершенную транскрипцию и классифицирует роли.
+    Если передан SHA-256 аудиофайла, сохраняет слова и роли в кэш.
+    """
+    with metrics.timed("format_transcription"):
+        formatted_transcription = format_transcription(status_data['words'])
+    roles = await classify_roles_with_openai(formatted_transcription)
+    if digest:
+        await transcription_cache.set(digest, {
+            "words": status_data['words'],
+            "roles": roles,
+            "mode": CLASSIFICATION_MODE,
+        })
+    return roles
+
+async def cached_roles(digest):
+    """
+    Возвращает роли из кэша транскрипций или None, если аудиофайл еще не обрабатывался.
+    Если роли получены в другом режиме классификации, переклассифицирует сохраненные слова без AssemblyAI.
+    """
+    entry = await transcription_cache.get(digest)
+    if entry is None:
+        return None
+
+    logger.info(f"Транскрипция {digest} найдена в кэше.")
+    if entry.get("mode") == CLASSIFICATION_MODE:
+        return entry["roles"]
+    return await process_transcript({"words": entry["words"]}, digest)
+
+# Обработки аудиофайлов, идущие прямо сейчас: SHA-256 -> задача asyncio
+_in_flight = {}
+
+async def single_flight(digest, work):
+    """
+    Выполняет work() один раз для одновременных запросов с одинаковым SHA-256 аудиофайла.
+    Повторный запрос (например, повтор из CRM) ждет уже идущую обработку, а не оплачивает AssemblyAI и OpenAI заново.
+    Обработка продолжается, даже если запросивший ее клиент отключился, чтобы результат попал в кэш.
+    """
+    task = _in_flight.get(digest)
+    if task is None:
+        task = asyncio.create_task(work())
+        _in_flight[digest] = task
+        task.add_done_callback(lambda done: _forget_in_flight(digest, done))
+    else:
+        logger.info(f"Аудиофайл {digest} уже обрабатывается, ожидаю результат.")
+    return await asyncio.shield(task)
+
+def _forget_in_flight(digest, task):
+    if _in_flight.get(digest) is task:
+        del _in_flight[digest]
+    # Ошибку получают ожидающие; если их не осталось, не засоряем лог предупреждением asyncio
+    if not task.cancelled():
+        task.exception()
+
+async def hash_upload(file_obj):
+    """
+    Считает SHA-256 загруженного файла по фрагментам и возвращает указатель в начало.
+    """
+    hasher = hashlib.sha256()
+    while chunk := await file_obj.read(UPLOAD_CHUNK_SIZE):
+        hasher.update(chunk)
+    await file_obj.seek(0)
+    return hasher.hexdigest()
+
+async def upload_chunks(file_obj):
+    """
+    Отдает загруженный файл фрагментами с начала для потоковой загрузки в AssemblyAI.
+    """
+    await file_obj.seek(0)
+    while chunk := await file_obj.read(UPLOAD_CHUNK_SIZE):
+        yield chunk
+
+async def file_chunks(path):
+    """
+    Отдает файл на диске фрагментами для потоковой загрузки в AssemblyAI.
+    """
+    with open(path, "rb") as file:
+        while chunk := await asyncio.to_thread(file.read, UPLOAD_CHUNK_SIZE):
+            yield chunk
+
+def hash_file(path):
+    """
+    Считает SHA-256 файла на диске по фрагментам.
+    """
+    hasher = hashlib.sha256()
+    with open(path, "rb") as file:
+        while chunk := file.read(UPLOAD_CHUNK_SIZE):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+async def transcribe_audio(file_obj):
+    """
+    Транскрибирует аудиофайл с помощью AssemblyAI и возвращает транскрипцию.
+    Одновременные запросы с тем же файлом ждут одну общую обработку.
+    """
+    digest = await hash_upload(file_obj)
+    try:
+        return await single_flight(digest, lambda: transcribe_upload(file_obj, digest))
+    except Exception as e:
+        logger.exception("Во время транскрипции произошла ошибка.")
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def transcribe_upload(file_obj, digest):
+    """
+    Возвращает роли из кэша или транскрибирует загруженный файл и классифицирует роли.
+    """
+    roles = await cached_roles(digest)
+    if roles is not None:
+        return roles
+
+    session = get_clients().assemblyai
+    with metrics.timed("transcribe"):
+        audio_url = await upload_audio(session, lambda: upload_chunks(file_obj))
+        transcript_id = await request_transcript(session, audio_url)
+        status_data = await wait_for_transcript(session, transcript_id)
+        return await process_transcript(status_data, digest)
 
 def format_transcription(words):
     """
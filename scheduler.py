@@ -0,0 +1,101 @@
+import os
+import time
+import random
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Квоты внешних API в минуту
+ASSEMBLYAI_UPLOADS_PER_MINUTE = float(os.getenv("ASSEMBLYAI_UPLOADS_PER_MINUTE", "60"))
+ASSEMBLYAI_JOBS_PER_MINUTE = float(os.getenv("ASSEMBLYAI_JOBS_PER_MINUTE", "60"))
+OPENAI_REQUESTS_PER_MINUTE = float(os.getenv("OPENAI_REQUESTS_PER_MINUTE", "3500"))
+OPENAI_TOKENS_PER_MINUTE = float(os.getenv("OPENAI_TOKENS_PER_MINUTE", "90000"))
+
+# Повторы запросов при 429 и 5xx: число попыток, базовая и максимальная задержка (в секундах)
+RETRY_ATTEMPTS = int(os.getenv("RETRY_ATTEMPTS", "5"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "1"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "60"))
+
+class TokenBucket:
+    """
+    Ограничитель частоты: ведро на capacity токенов, пополняемое со скоростью rate токенов в секунду.
+    """
+
+    def __init__(self, per_minute, capacity=None):
+        self.rate = per_minute / 60
+        self.capacity = capacity or max(per_minute / 60, 1.0)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self, amount=1):
+        """
+        Ожидает, пока в ведре наберется amount токенов, и забирает их. Запросы обслуживаются по очереди.
+        """
+        amount = min(amount, self.capacity)
+        async with self.lock:
+            self.refill()
+            while self.tokens < amount:
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+                self.refill()
+            self.tokens -= amount
+
+class RateLimits:
+    """
+    Отдельные ограничители для загрузок и задач AssemblyAI, запросов и токенов OpenAI.
+    """
+
+    def __init__(self):
+        self.assemblyai_uploads = TokenBucket(ASSEMBLYAI_UPLOADS_PER_MINUTE)
+        self.assemblyai_jobs = TokenBucket(ASSEMBLYAI_JOBS_PER_MINUTE)
+        self.openai_requests = TokenBucket(OPENAI_REQUESTS_PER_MINUTE)
+        self.openai_tokens = TokenBucket(OPENAI_TOKENS_PER_MINUTE, capacity=OPENAI_TOKENS_PER_MINUTE / 6)
+
+    async def openai(self, tokens):
+        await self.openai_requests.acquire()
+        await self.openai_tokens.acquire(tokens)
+
+rate_limits = RateLimits()
+
+class TransientError(Exception):
+    """
+    Временная ошибка внешнего API (429 или 5xx), после которой запрос стоит повторить.
+    """
+
+    def __init__(self, status, detail="", retry_after=None):
+        super().__init__(f"{status}: {detail}")
+        self.status = status
+        self.detail = detail
+        self.retry_after = retry_after
+
+def is_transient(status):
+    return status == 429 or status >= 500
+
+def retry_after_seconds(headers):
+    """
+    Читает заголовок Retry-After (в секундах), если он есть.
+    """
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+async def with_retries(call, attempts=RETRY_ATTEMPTS):
+    """
+    Выполняет call() и повторяет при TransientError с экспоненциальной задержкой и случайным разбросом.
+    """
+    for attempt in range(attempts):
+        try:
+            return await call()
+        except TransientError as e:
+            if attempt == attempts - 1:
+                raise
+            delay = e.retry_after or random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+            logger.warning(f"Временная ошибка API ({e}). Повтор через {delay:.1f} с.")
+            await asyncio.sleep(delay)
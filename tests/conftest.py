@@ -0,0 +1,12 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Окружение задается до импорта модулей сервиса: ключевые фразы из репозитория,
+# без дисковых кэшей и без локальной модели ролей
+os.environ["KEY_PHRASES_PATH"] = os.path.join(ROOT, "key_phrases.json")
+os.environ["LOCAL_MODEL_PATH"] = os.path.join(ROOT, "tests", "missing_role_model.json")
+os.environ["TRANSCRIPTION_CACHE_DIR"] = ""
+os.environ["ROLE_CACHE_PATH"] = ""
@@ -0,0 +1,94 @@
+import json
+import asyncio
+import pytest
+from fastapi import HTTPException
+import repository
+from cache import RolePredictionCache
+
+# Фразы без ключевых фраз, приветствий и поддакиваний: их роль определяет только OpenAI
+NEUTRAL_LINES = [
+    "Мы живем за городом уже пять лет.",
+    "Собака у нас большая и очень шумная.",
+    "Вечером обычно все дома после работы.",
+    "Соседи недавно поменяли забор на участке.",
+]
+
+def dialogue(count):
+    return [
+        {"text": NEUTRAL_LINES[i % len(NEUTRAL_LINES)], "speaker": "AB"[i % 2]}
+        for i in range(count)
+    ]
+
+def completion(content):
+    return {"choices": [{"message": {"role": "assistant", "content": content}}]}
+
+@pytest.fixture(autouse=True)
+def fresh_role_cache(monkeypatch):
+    monkeypatch.setattr(repository, "role_cache", RolePredictionCache(1000, None, 0.75))
+
+def stub_openai(monkeypatch, answer):
+    """
+    Подменяет запрос к OpenAI. answer(kind, messages) возвращает ответ или вызывает исключение.
+    Возвращает список видов выполненных запросов.
+    """
+    calls = []
+
+    async def chat_completion(messages, kind="utterance", max_tokens=None):
+        calls.append(kind)
+        return answer(kind, messages)
+
+    monkeypatch.setattr(repository, "chat_completion", chat_completion)
+    return calls
+
+def test_neutral_lines_need_openai():
+    session = repository.DialogueSession()
+    assert all(repository.heuristic_role(text, session) is None for text in NEUTRAL_LINES)
+
+def test_parse_batch_roles_reads_expected_numbers():
+    content = 'Ответ: {"1": "Менеджер", "2": "Клиент", "3": "Менеджер."}'
+    assert repository.parse_batch_roles(content, [1, 3]) == {1: "Менеджер", 3: "Менеджер"}
+
+def test_parse_batch_roles_skips_unknown_roles():
+    content = json.dumps({"1": "Оператор", "2": "Клиент"}, ensure_ascii=False)
+    assert repository.parse_batch_roles(content, [1, 2]) == {2: "Клиент"}
+
+@pytest.mark.parametrize("content", ["", "Менеджер", "{не json}", "[1, 2]", '{"1": "Менеджер"'])
+def test_parse_batch_roles_malformed(content):
+    assert repository.parse_batch_roles(content, [1, 2]) == {}
+
+def test_batch_failure_uses_default_without_more_requests(monkeypatch):
+    def answer(kind, messages):
+        raise HTTPException(status_code=500, detail="429 Too Many Requests")
+
+    calls = stub_openai(monkeypatch, answer)
+    transcription = dialogue(repository.BATCH_MAX_UTTERANCES)
+
+    classified = asyncio.run(repository.classify_roles_batched(transcription, repository.DialogueSession()))
+
+    assert calls == ["batch"]
+    assert [entry["role"] for entry in classified] == ["Клиент"] * len(transcription)
+
+def test_missing_batch_roles_fall_back_per_utterance(monkeypatch):
+    def answer(kind, messages):
+        if kind == "batch":
+            # Роль третьей фразы в ответе отсутствует
+            return completion('{"1": "Менеджер", "2": "Клиент", "4": "Клиент"}')
+        return completion("Менеджер")
+
+    calls = stub_openai(monkeypatch, answer)
+
+    classified = asyncio.run(repository.classify_roles_batched(dialogue(4), repository.DialogueSession()))
+
+    assert calls == ["batch", "utterance"]
+    assert [entry["role"] for entry in classified] == ["Менеджер", "Клиент", "Менеджер", "Клиент"]
+
+def test_unparseable_batch_answer_falls_back_per_utterance(monkeypatch):
+    def answer(kind, messages):
+        return completion("Не знаю" if kind == "batch" else "Клиент")
+
+    calls = stub_openai(monkeypatch, answer)
+
+    classified = asyncio.run(repository.classify_roles_batched(dialogue(3), repository.DialogueSession()))
+
+    assert calls == ["batch", "utterance", "utterance", "utterance"]
+    assert [entry["role"] for entry in classified] == ["Клиент"] * 3
@@ -0,0 +1,24 @@
+import asyncio
+from cache import TranscriptionCache
+
+def make_cache(directory):
+    return TranscriptionCache(str(directory), 10, 10 ** 9, 3600, 10 ** 6)
+
+def test_disk_hit_after_restart_counts_as_hit(tmp_path):
+    asyncio.run(make_cache(tmp_path).set("digest", {"roles": []}))
+
+    restarted = make_cache(tmp_path)
+    assert asyncio.run(restarted.get("digest")) == {"roles": []}
+    assert asyncio.run(restarted.get("digest")) == {"roles": []}
+    assert asyncio.run(restarted.get("other")) is None
+
+    stats = restarted.stats()
+    assert (stats["memory_hits"], stats["disk_hits"], stats["hits"], stats["misses"]) == (1, 1, 2, 1)
+    assert stats["hit_rate"] == 2 / 3
+
+def test_malformed_disk_entry_is_a_miss(tmp_path):
+    cache = make_cache(tmp_path)
+    for digest, content in [("no_value", '{"created_at": 1e12}'), ("no_time", '{"value": 1}'), ("list", "[1, 2]"), ("broken", "{")]:
+        (tmp_path / f"{digest}.json").write_text(content, encoding="utf-8")
+        assert asyncio.run(cache.get(digest)) is None
+        assert not (tmp_path / f"{digest}.json").exists()
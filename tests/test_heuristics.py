@@ -0,0 +1,33 @@
+import pytest
+import repository
+
+# Реплики и роли, которые правило ключевых фраз давало до перехода на индекс Ахо-Корасик
+SAMPLE_LINES = [
+    ("Меня зовут Анна, вы хотели сделать ремонт и дизайн квартиры?", "Менеджер"),
+    ("Подскажите, вы хотели ремонт квартиры или дизайн офиса?", "Менеджер"),
+]
+
+@pytest.mark.parametrize("text, role", SAMPLE_LINES)
+def test_manager_phrase_wins(text, role):
+    assert repository.heuristic_role(text, repository.DialogueSession()) == role
+
+def test_client_phrase_without_manager_phrase():
+    index = repository.phrase_index.get_index()
+    client_only = [
+        hit.phrase for hit in index.entries
+        if hit.side == "client" and index.side_weights(hit.phrase)["manager"] == 0
+    ]
+    assert client_only
+    assert repository.heuristic_role(client_only[0], repository.DialogueSession()) == "Клиент"
+
+def test_greeting_order_without_phrases():
+    session = repository.DialogueSession()
+    assert repository.heuristic_role("Добрый день!", session) == "Менеджер"
+    assert repository.heuristic_role("Добрый день!", session) == "Клиент"
+    assert repository.heuristic_role("Добрый день!", session) is None
+
+def test_weighted_decision_is_opt_in(monkeypatch):
+    weights = {"manager": 1.0, "client": 2.0}
+    assert repository.phrase_role(weights) == "Менеджер"
+    monkeypatch.setattr(repository, "PHRASE_DECISION", "weighted")
+    assert repository.phrase_role(weights) == "Клиент"
@@ -0,0 +1,56 @@
+import asyncio
+import pytest
+import repository
+
+def test_concurrent_calls_share_one_run():
+    runs = []
+
+    async def work():
+        runs.append(1)
+        await asyncio.sleep(0.01)
+        return ["roles"]
+
+    async def main():
+        results = await asyncio.gather(*(repository.single_flight("digest", work) for _ in range(5)))
+        # Завершенная обработка не задерживается: следующий вызов выполняется заново
+        results.append(await repository.single_flight("digest", work))
+        return results
+
+    assert asyncio.run(main()) == [["roles"]] * 6
+    assert len(runs) == 2
+    assert repository._in_flight == {}
+
+def test_error_reaches_every_waiter():
+    async def work():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("AssemblyAI недоступен")
+
+    async def main():
+        return await asyncio.gather(
+            *(repository.single_flight("digest", work) for _ in range(3)),
+            return_exceptions=True
+        )
+
+    results = asyncio.run(main())
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+def test_cancelled_caller_does_not_cancel_work():
+    finished = []
+
+    async def work():
+        await asyncio.sleep(0.02)
+        finished.append(1)
+        return "done"
+
+    async def main():
+        first = asyncio.create_task(repository.single_flight("digest", work))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(repository.single_flight("digest", work))
+        await asyncio.sleep(0.005)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(main()) == "done"
+    assert finished == [1]